@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""
+micro-benchmark for fredapi.clean_series: per-observation cost of turning a FRED observations
+payload into the cleaned data frame, old path (frame from records, regex replace, astype, unformatted
+to_datetime, drop/rename) against the current one. runs offline on a synthetic payload.
+
+python bench/clean_series.py [n_obs] [n_series]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'get_clean'))
+
+import fredapi
+
+
+def payload(n, missing = 0.05, seed = 0):
+    """n daily observations as FRED sends them, with missing values as '.'"""
+    rng = np.random.default_rng(seed)
+    date = (np.datetime64('1960-01-01') + np.arange(n)).astype(str)
+    value = np.char.mod('%.3f', rng.uniform(0, 100, n)).astype(object)
+    value[rng.random(n) < missing] = '.'
+
+    return [dict(realtime_start = '2021-05-01', realtime_end = '2021-05-01', date = d, value = v) for d, v in zip(date, value)]
+
+
+def before(obs, ids):
+    d = pd.DataFrame(obs)
+    d = d.drop(columns = ['realtime_start', 'realtime_end'])
+    d.value = d.value.str.replace(r'^\.$', 'NaN', regex = True).astype('float')
+    d.date = pd.to_datetime(d.date)
+    d = d.rename(columns = {'value': ids})
+
+    return d
+
+
+def timed(f, reps = 5):
+    best = float('inf')
+    for _ in range(reps):
+        t = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    series = [payload(n, seed = i) for i in range(k)]
+    after = fredapi.clean_series(lambda obs, ids = None: obs)
+
+    for obs in series[:1]:
+        pd.testing.assert_frame_equal(before(obs, 'X'), after(obs, ids = 'X'))
+
+    t_before = timed(lambda: [before(obs, 'X') for obs in series])
+    t_after = timed(lambda: [after(obs, ids = 'X') for obs in series])
+
+    per = 1e9 / (n * k)
+    print(f"{k} series x {n} observations")
+    print(f"before: {t_before * per:8.1f} ns/obs")
+    print(f"after:  {t_after * per:8.1f} ns/obs  ({t_before / t_after:.1f}x)")
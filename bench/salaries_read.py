@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""
+load time and peak RSS of salaries.get_salaries per engine, plus the columnar cache.
+each engine runs in a fresh process so peak RSS is its own. run from the repository root.
+
+python bench/salaries_read.py [workbook]
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'get_clean'))
+
+import salaries
+
+
+def peak_rss():
+    """peak resident set size of this process in MB. VmHWM where there is /proc, since on linux
+    ru_maxrss carries over the parent's peak across fork and exec"""
+    try:
+        with open('/proc/self/status') as f:
+            return [int(l.split()[1]) for l in f if l.startswith('VmHWM')][0] / 2**10
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+# runs in the child: python bench/salaries_read.py --child engine workbook
+def child(engine, file):
+    import time
+
+    # imports alone account for most of the RSS on small workbooks, so report the growth over that too
+    base = peak_rss()
+    t = time.perf_counter()
+
+    if engine == 'cache':
+        d = salaries.get_salaries(file)
+    else:
+        d = salaries.get_salaries(file, engine = engine, cache = False)
+
+    t = time.perf_counter() - t
+    rss = peak_rss()
+
+    print(json.dumps(dict(engine = engine, seconds = t, peak_rss_mb = rss, growth_mb = rss - base, rows = d.shape[0])))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['--child']:
+        child(*sys.argv[2:4])
+        sys.exit()
+
+    file = sys.argv[1] if len(sys.argv) > 1 else salaries.raw_file
+
+    # make sure the cache exists and is current before timing reads from it
+    salaries.get_salaries(file)
+
+    for engine in list(salaries.readers) + ['cache']:
+        r = subprocess.run([sys.executable, '-W', 'ignore', __file__, '--child', engine, file], capture_output = True, text = True)
+
+        if r.returncode != 0:
+            print(f"{engine:10s} failed: {r.stderr.strip().splitlines()[-1]}")
+            continue
+
+        r = json.loads(r.stdout)
+        print(f"{engine:10s} {r['seconds']:7.3f} s  {r['peak_rss_mb']:7.1f} MB peak RSS (+{r['growth_mb']:.1f} MB reading)  {r['rows']} rows")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+regression check and timing for salaries.standardize against the original implementation (kept below as before).
+values must match exactly once the new dtypes (categories, downcast integers) are cast back to the old ones.
+the workbook can be replicated to time larger exports. run from the repository root.
+
+python bench/salaries_standardize.py [times]
+"""
+
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'get_clean'))
+
+import salaries
+
+
+def before(d):
+    d.columns = d.columns.str.lower().str.replace(r"\s+", "_", regex = True).str.replace('employee_', '', regex = True)
+    d.loc[:, d.dtypes.eq('object')] = d.loc[:, d.dtypes.eq('object')].apply(lambda x: x.str.lower())
+    d = d.assign(initial_hire_date = pd.to_datetime(d.initial_hire_date),
+                 hire_year = lambda x: x.initial_hire_date.dt.year)
+
+    return d
+
+
+def timed(f, raw, reps = 3):
+    best = float('inf')
+    for _ in range(reps):
+        d = raw.copy()
+        t = time.perf_counter()
+        out = f(d)
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+if __name__ == "__main__":
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+    raw = salaries.get_salaries(salaries.raw_file, cache = False)
+    raw = pd.concat([raw] * k, ignore_index = True)
+
+    t_before, old = timed(before, raw)
+    t_after, new = timed(salaries.standardize, raw)
+
+    # regression: same columns, same values
+    pd.testing.assert_frame_equal(new.astype(old.dtypes.to_dict()), old)
+    print(f"{raw.shape[0]} rows: output values identical")
+
+    mb = lambda d: d.memory_usage(deep = True).sum() / 2**20
+    print(f"before: {t_before:7.3f} s  {mb(old):7.1f} MB")
+    print(f"after:  {t_after:7.3f} s  {mb(new):7.1f} MB  ({t_before / t_after:.1f}x faster)")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+import time of every get_clean entry point against a startup budget, from python -X importtime.
+
+each module is imported in a fresh process, reps times, and the best cumulative time of its top-level import
+is kept. two checks per module:
+    budget     seconds the import may take beyond the time spent in it importing pandas and numpy. every data
+               module needs those, and their import time depends on the machine, not on this code
+    deferred   heavy backends (plotting, rasters, http) the import must not load, they load on first use
+
+exits non-zero if any module fails a check, so it can guard startup in ci. run from the repository root.
+
+python bench/startup.py [--modules canopy ...] [--reps 5] [--verbose]
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+get_clean = os.path.join(here, '..', 'get_clean')
+
+
+# seconds beyond importing baseline
+budget = dict(canopy = 0.05, fredapi = 0.05, covid_nyt = 0.05, salaries = 0.05, catalog = 0.05, sampling = 0.05,
+              instrument = 0.05, util = 0.05, buildcache = 0.05, httpcache = 0.05, build = 0.05)
+
+baseline = ['pandas', 'numpy']
+
+# pyarrow is left out, pandas loads it itself where installed
+heavy = ['rasterio', 'matplotlib', 'dbfread', 'requests', 'openpyxl', 'python_calamine']
+
+# build loads the data modules when tasks run, so its import needs not even pandas
+deferred = {m: heavy for m in budget}
+deferred['build'] = heavy + ['pandas', 'numpy']
+
+
+def importtime(module):
+    """({top-level package: cumulative seconds}, seconds of that spent importing baseline packages) for a fresh
+    import of module, from -X importtime"""
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd = get_clean,
+                       capture_output = True, text = True)
+    if p.returncode != 0:
+        raise RuntimeError((p.stderr.strip().splitlines() or ['failed'])[-1])
+
+    times = {}
+    # the log lists each import after the ones it made, one level deeper. stack holds (depth, baseline seconds)
+    # of imports whose parent hasn't been listed yet
+    stack = []
+    for l in p.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not l.startswith('import time:') or not l.split('|')[1].strip().isdigit():
+            continue
+        _, cumulative, name = l.split('|')
+        depth, name, cumulative = (len(name) - len(name.lstrip()) - 1) // 2, name.strip(), int(cumulative) / 1e6
+
+        under = 0
+        while stack and stack[-1][0] > depth:
+            under += stack.pop()[1]
+        stack.append((depth, cumulative if name.split('.')[0] in baseline else under))
+
+        # packages at any depth, since e.g. pandas is first imported by whichever module gets to it first
+        if '.' not in name:
+            times[name] = max(times.get(name, 0), cumulative)
+
+    return times, stack[-1][1]
+
+
+def check(module, reps):
+    """best of reps imports of module: its import time, the time beyond baseline packages, and deferred packages it loaded"""
+    runs = [importtime(module) for _ in range(reps)]
+    t, base = min(runs, key = lambda r: r[0][module] - r[1])
+
+    return dict(module = module, seconds = t[module], extra = t[module] - base, loaded = [p for p in deferred[module] if p in t]), t
+
+
+#####
+#RUN
+#####
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Check the import time of the get_clean modules against a startup budget. run from the repository root')
+    parser.add_argument('--modules', nargs = '+', default = list(budget), help = f'any of {" ".join(budget)}')
+    parser.add_argument('--reps', type = int, default = 5, help = 'imports per module, the best is kept')
+    parser.add_argument('--verbose', action = 'store_true', help = 'also print the slowest packages each module loads')
+
+    args = parser.parse_args()
+
+    unknown = [m for m in args.modules if m not in budget]
+    if unknown:
+        parser.error(f'unknown modules {unknown}')
+
+    failed = []
+    for m in args.modules:
+        try:
+            r, t = check(m, args.reps)
+        except RuntimeError as e:
+            print(f'{m:12s} failed to import: {e}')
+            failed.append(m)
+            continue
+
+        over = r['extra'] > budget[m]
+        status = 'ok' if not over and not r['loaded'] else 'FAIL'
+        print(f"{m:12s} {r['seconds']:7.3f} s  {r['extra']:7.3f} s beyond pandas, numpy (budget {budget[m]:g})  {status}"
+              + (f"  loads {' '.join(r['loaded'])}" if r['loaded'] else ''))
+        if status != 'ok':
+            failed.append(m)
+
+        if args.verbose:
+            for k, v in sorted(t.items(), key = lambda kv: -kv[1])[:8]:
+                print(f'{"":14s}{v:7.3f} s  {k}')
+
+    sys.exit(1 if failed else 0)
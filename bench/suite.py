@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""
+time and peak memory of every cleaning stage on synthetic inputs (see synthetic.py), fully offline.
+
+each stage runs in a fresh process: its inputs are generated (untimed), then the stage runs reps times and
+the best time is kept. peak memory is the peak resident set size while the stage ran above what the process
+held before it, from VmHWM (reset through /proc/self/clear_refs where allowed, else the process peak).
+
+results go to a json file with the scale, seed, git revision and package versions, and --compare prints the
+ratio of each stage against an earlier results file. run from the repository root.
+
+python bench/suite.py [--scale 1] [--stages covid_by_co ...] [--out bench/results/x.json] [--compare old.json]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import platform
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'get_clean'))
+sys.path.insert(0, here)
+
+
+#####
+# STAGES
+#####
+
+# each setup(scale, seed, tmp) returns the zero-argument call to measure
+
+def _covid_by_co(scale, seed, tmp):
+    import covid_nyt, synthetic
+    d = synthetic.nyt_counties(scale, seed)
+    return lambda: covid_nyt.covid_by_co(data = d.copy())
+
+
+def _covid_csv(scale, seed, tmp):
+    import synthetic
+    file = os.path.join(tmp, 'covid_nyt.csv')
+    synthetic.nyt_counties(scale, seed).to_csv(file, index = False)
+    return file
+
+
+def _covid_by_co_stream(scale, seed, tmp):
+    import covid_nyt
+    file = _covid_csv(scale, seed, tmp)
+    return lambda: covid_nyt.covid_by_co_stream(file)
+
+
+def _project_data(scale, seed, tmp):
+    import covid_nyt, synthetic
+    file, masks = _covid_csv(scale, seed, tmp), synthetic.nyt_masks(seed)
+    return lambda: covid_nyt.project_data(county = file, masks = masks.copy())
+
+
+def _sample_and_dump(scale, seed, tmp):
+    import covid_nyt, synthetic
+    d = covid_nyt.project_data(county = synthetic.nyt_counties(1, seed), masks = synthetic.nyt_masks(seed))
+    # undecorated, and written as csv to tmp rather than the project path
+    return lambda: covid_nyt.sample_and_dump.__wrapped__(d, int(200 * scale), seed = seed).write(tmp, 'CV', formats = ('csv',))
+
+
+def _canopy_unpack(scale, seed, tmp):
+    import canopy, synthetic
+    d, area = synthetic.canopy_counts(scale, seed)
+    return lambda: canopy.unpack(data = d.copy(), county_area = area)
+
+
+def _canopy_histogram(scale, seed, tmp):
+    import canopy, synthetic
+    d, area = synthetic.canopy_counts(scale, seed)
+    return lambda: canopy.histogram(data = d.copy(), county_area = area).sample(int(n_draws * scale), seed = seed)
+
+
+def _salaries_standardize(scale, seed, tmp):
+    import salaries, synthetic
+    d = synthetic.salaries_raw(scale, seed)
+    return lambda: salaries.standardize(d.copy())
+
+
+def _fred_clean_series(scale, seed, tmp):
+    import fredapi, synthetic
+    payloads = synthetic.fred_payloads(scale, seed)
+    clean = fredapi.clean_series(lambda obs, ids = None: obs)
+    return lambda: [clean(obs, ids = k) for k, obs in payloads.items()]
+
+
+# draws from the canopy histogram at scale 1
+n_draws = 200000
+
+stages = dict(covid_by_co = _covid_by_co, covid_by_co_stream = _covid_by_co_stream, project_data = _project_data,
+              sample_and_dump = _sample_and_dump, canopy_unpack = _canopy_unpack, canopy_histogram = _canopy_histogram,
+              salaries_standardize = _salaries_standardize, fred_clean_series = _fred_clean_series)
+
+
+#####
+# MEASURE
+#####
+
+def _status(field):
+    # kB field of /proc/self/status in MB, None off linux
+    try:
+        with open('/proc/self/status') as f:
+            return [int(l.split()[1]) for l in f if l.startswith(field)][0] / 2**10
+    except OSError:
+        return None
+
+
+def _reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def run_stage(name, scale, seed, reps):
+    """measure one stage in this process, see module description"""
+    with tempfile.TemporaryDirectory() as tmp:
+        # relative paths in the modules (raw/...) resolve inside tmp, so nothing real is read or written
+        os.chdir(tmp)
+        f = stages[name](scale, seed, tmp)
+
+        reset = _reset_peak()
+        before = _status('VmRSS')
+
+        best = float('inf')
+        for _ in range(reps):
+            t = time.perf_counter()
+            f()
+            best = min(best, time.perf_counter() - t)
+
+        peak = _status('VmHWM')
+
+    return dict(stage = name, seconds = best, peak_mb = None if peak is None else peak - before if reset else peak)
+
+
+def run(names, scale, seed, reps):
+    """run_stage for each of names in a fresh process. stages whose modules can't be imported are skipped"""
+    out = []
+    for name in names:
+        p = subprocess.run([sys.executable, os.path.abspath(__file__), '--stage', name, '--scale', str(scale),
+                            '--seed', str(seed), '--reps', str(reps)], capture_output = True, text = True)
+
+        if p.returncode != 0:
+            err = (p.stderr.strip().splitlines() or ['failed'])[-1]
+            print(f'{name:22s} skipped: {err}')
+            out.append(dict(stage = name, seconds = None, peak_mb = None, error = err))
+            continue
+
+        r = json.loads(p.stdout.strip().splitlines()[-1])
+        print(f"{name:22s} {r['seconds']:9.3f} s  {r['peak_mb'] if r['peak_mb'] is not None else float('nan'):9.1f} MB")
+        out.append(r)
+
+    return out
+
+
+def _versions():
+    import numpy, pandas
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = here, capture_output = True, text = True).stdout.strip()
+    except OSError:
+        rev = None
+
+    return dict(revision = rev, python = platform.python_version(), numpy = numpy.__version__, pandas = pandas.__version__)
+
+
+def compare(base, new):
+    """print new against base, per stage in both: time and peak memory ratios"""
+    old = {r['stage']: r for r in base['results'] if r.get('seconds') is not None}
+
+    print(f"against {base.get('revision')} at scale {base.get('scale')}")
+    for r in new['results']:
+        o = old.get(r['stage'])
+        if o is None or r.get('seconds') is None:
+            continue
+
+        mem = f"{r['peak_mb'] / o['peak_mb']:6.2f}x memory" if r['peak_mb'] and o['peak_mb'] else ''
+        print(f"{r['stage']:22s} {r['seconds'] / o['seconds']:6.2f}x time  {mem}")
+
+
+#####
+#RUN
+#####
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('Benchmark the cleaning stages on synthetic data. run from the repository root')
+    parser.add_argument('--scale', type = float, default = 1, help = 'input size relative to the real data, e.g. 1 to 100')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--reps', type = int, default = 3, help = 'runs per stage, the best is kept')
+    parser.add_argument('--stages', nargs = '+', default = list(stages), help = f'any of {" ".join(stages)}')
+    parser.add_argument('--out', type = str, default = None, help = 'results file, default bench/results/{revision}-{scale}x.json')
+    parser.add_argument('--compare', type = str, default = None, help = 'earlier results file to compare against')
+    parser.add_argument('--stage', type = str, default = None, help = argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.stage is not None:
+        print(json.dumps(run_stage(args.stage, args.scale, args.seed, args.reps)))
+        sys.exit()
+
+    unknown = [s for s in args.stages if s not in stages]
+    if unknown:
+        parser.error(f'unknown stages {unknown}')
+
+    res = dict(scale = args.scale, seed = args.seed, reps = args.reps, time = time.strftime('%Y-%m-%d %H:%M:%S'),
+               **_versions(), results = run(args.stages, args.scale, args.seed, args.reps))
+
+    out = args.out or os.path.join(here, 'results', f"{res['revision']}-{args.scale:g}x.json")
+    os.makedirs(os.path.dirname(out) or '.', exist_ok = True)
+    with open(out, 'w') as f:
+        json.dump(res, f, indent = 1)
+    print(f'results in {out}')
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(json.load(f), res)
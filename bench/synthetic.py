@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""
+seeded synthetic inputs shaped like the raw sources, for benchmarking the cleaning pipelines offline.
+scale 1 is about the size of the real data in spring 21, every generator scales linearly with it.
+
+    nyt_counties    us-counties.csv: date, county, state, fips, cumulative cases and deaths
+    nyt_masks       mask-use-by-county.csv for the same counties
+    canopy_counts   dbf_to_df output for a county: Value, Count and the colour map
+    salaries_raw    get_salaries output: the workbook columns, hire dates as exported
+    fred_payloads   FRED series/observations records, missing values as '.'
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _rng(seed):
+    return np.random.default_rng(seed)
+
+
+# NYT
+
+n_states = 55
+n_counties = 3200
+n_days = 400
+
+
+def _counties(seed):
+    # county, state and fips for n_counties counties, with a few 'Unknown' ones without fips as in the NYT data
+    rng = _rng(seed)
+    state = rng.integers(1, n_states + 1, n_counties)
+    fips = (state * 1000 + pd.Series(state).groupby(state).cumcount().to_numpy()).astype('float64')
+
+    unknown = rng.random(n_counties) < 0.01
+    fips[unknown] = np.nan
+    county = np.where(unknown, 'Unknown', np.char.add('County ', np.arange(n_counties).astype(str)))
+
+    return pd.DataFrame(dict(county = county, state = np.char.add('State ', state.astype(str)), fips = fips))
+
+
+def nyt_counties(scale = 1, seed = 0):
+    """one row per county per day, ordered by date as NYT publishes it. scale lengthens the series"""
+    rng = _rng(seed)
+    co = _counties(seed)
+    days = int(n_days * scale)
+
+    new = rng.poisson(rng.gamma(1, 10, n_counties), (days, n_counties))
+    cases = new.cumsum(axis = 0)
+    deaths = rng.binomial(new, 0.015).cumsum(axis = 0)
+
+    date = np.repeat(np.datetime64('2020-01-21') + np.arange(days), n_counties).astype(str)
+
+    return pd.DataFrame(dict(date = date, county = np.tile(co.county, days), state = np.tile(co.state, days),
+                             fips = np.tile(co.fips, days), cases = cases.ravel(), deaths = deaths.ravel()))
+
+
+def nyt_masks(seed = 0):
+    """mask use shares for the counties of nyt_counties(seed = seed), as in the raw file"""
+    rng = _rng(seed)
+    co = _counties(seed).dropna(subset = ['fips']).drop_duplicates('fips')
+    share = rng.dirichlet(np.ones(5), co.shape[0])
+
+    d = pd.DataFrame(share, columns = ['NEVER', 'RARELY', 'SOMETIMES', 'FREQUENTLY', 'ALWAYS'])
+    return d.assign(COUNTYFP = co.fips.astype('int64').to_numpy()).loc[:, ['COUNTYFP', 'NEVER', 'RARELY', 'SOMETIMES', 'FREQUENTLY', 'ALWAYS']]
+
+
+# CANOPY
+
+n_cells = 860000
+
+
+def canopy_counts(scale = 1, seed = 0):
+    """(counts, county_area): value counts of a county's canopy raster with the dbf's colour columns, and a land
+    area in km^2 a little under the cells' total so that zero deflation applies. scale multiplies the cells"""
+    rng = _rng(seed)
+    value = np.r_[0, np.arange(9, 100)]
+
+    p = np.r_[0.25, rng.dirichlet(np.ones(value.size - 1)) * 0.75]
+    count = rng.multinomial(int(n_cells * scale), p).astype('float64')
+
+    grey = 255 - value * 0.7
+    d = pd.DataFrame(dict(Value = value, Count = count, Red = grey.astype(int), Green = (grey + 5).clip(0, 255).astype(int), Blue = grey.astype(int)))
+    d = d.loc[d.Count > 0].reset_index(drop = True)
+
+    return d, int(d.Count.sum() * 900 / 1e6) - 5
+
+
+# SALARIES
+
+n_employees = 13100
+
+
+def salaries_raw(scale = 1, seed = 0):
+    """salaries workbook as get_salaries returns it, n_employees * scale rows with the real cardinalities"""
+    rng = _rng(seed)
+    n = int(n_employees * scale)
+
+    def pick(prefix, k):
+        return np.char.add(prefix, rng.integers(0, k, n).astype(str)).astype(object)
+
+    hire = np.datetime64('1970-01-01') + rng.integers(0, 18600, n).astype('timedelta64[D]')
+    hire = pd.to_datetime(hire).strftime('%b %d, %Y').str.upper()
+
+    return pd.DataFrame({'INSTITUTION NAME': 'UNC-CH',
+                         'LAST NAME': pick('LAST', int(8600 * scale)),
+                         'FIRST NAME': pick('First', 4400),
+                         'INIT': pick('', 32),
+                         'AGE': rng.integers(18, 90, n),
+                         'INITIAL HIRE DATE': hire.to_numpy(dtype = object),
+                         'JOB CATEGORY': pick('Job Category ', 450),
+                         'EMPLOYEE ANNUAL BASE SALARY': rng.lognormal(11, 0.5, n).round(2),
+                         'EMPLOYEE HOME DEPARTMENT': pick('Dept ', 730),
+                         'PRIMARY WORKING TITLE': pick('Title ', 680)})
+
+
+# FRED
+
+n_series = 100
+n_obs = 300
+
+
+def fred_payloads(scale = 1, seed = 0, missing = 0.05):
+    """{series id: observation records} for n_series * scale quarterly series of n_obs observations"""
+    rng = _rng(seed)
+    date = pd.date_range('1947-01-01', periods = n_obs, freq = 'QS').strftime('%Y-%m-%d')
+
+    out = {}
+    for i in range(int(n_series * scale)):
+        value = np.char.mod('%.3f', rng.uniform(0, 100, n_obs)).astype(object)
+        value[rng.random(n_obs) < missing] = '.'
+        out[f'SERIES{i}'] = [dict(realtime_start = '2021-05-01', realtime_end = '2021-05-01', date = d, value = v) for d, v in zip(date, value)]
+
+    return out
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+"""
+one entry point for the semester refresh of every dataset, run as a dependency graph of tasks
+
+    covid.fetch     covid_nyt.get_raw                       thread, only with --get
+    covid.clean     covid_nyt.load_project_data             process
+    covid.sample    covid_nyt.sample_and_dump               thread
+    fred.index      fredapi series index refresh            thread, only with --fred-key
+    fred.sample     fredapi.get_and_dump                    thread, only with --fred-key
+    canopy.clean    canopy.clean_and_dump                   thread
+    canopy.plot     canopy.plot_canopies                    thread
+    salaries.clean  salaries.clean_and_dump                 process
+    catalog         catalog ingestion of the cleaned data   main thread, only with --catalog
+
+a task runs as soon as the tasks it depends on are done: on a thread pool for network-bound work and for tasks
+that fan out over processes themselves (canopy counties, sample writers), on a process pool for single-threaded
+CPU work. a task is skipped when all its outputs exist and are newer than its inputs and the module files it
+runs, and it last ran with the same n, seed and formats (recorded in stamp_dir), and not run when an input is missing or a task it depends on failed. at the end the status and time of
+every task is printed, along with the critical path: the chain of dependent tasks that set the wall time.
+
+python get_clean/build.py N [--get] [--fred-key KEY] [--catalog] [--only covid canopy ...] [--force] [--dry-run]
+"""
+
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# where the modules write their outputs, relative to the repository root
+covid_out = '../stor155_sp21/project/CV'
+fred_out = '../stor155_sp21/project/FRED'
+canopy_out = '../stor155_sp21/final_project/canopy'
+salaries_out = '../stor155_sp21/final_project/salaries'
+
+# a hash of the params each task last ran with, one file per task
+stamp_dir = 'raw/.buildstamps'
+
+
+class Task:
+    """fn(*args) run on pool (thread, process or main) once every task in deps is done. tasks share data through
+    files and the build cache, not return values. inputs and outputs are file paths for the up to date check,
+    modules the get_clean modules fn runs. params are the arguments the outputs depend on (default args), the
+    outputs are only up to date when the task last ran with the same ones. always runs the task whenever it is
+    reached, for tasks refreshing from a remote source"""
+
+    def __init__(self, name, fn, args = (), deps = (), pool = 'thread', inputs = (), outputs = (), modules = (),
+                 params = None, always = False):
+        self.name, self.fn, self.args, self.deps, self.pool = name, fn, tuple(args), list(deps), pool
+        self.inputs = list(inputs) + [os.path.join(here, f'{m}.py') for m in modules]
+        self.outputs = list(outputs)
+        self.params = self.args if params is None else tuple(params)
+        self.always = always
+
+    def missing(self):
+        return [f for f in self.inputs if not os.path.exists(f)]
+
+    def _stamp_file(self):
+        return os.path.join(stamp_dir, f'{self.name}.json')
+
+    def _params_hash(self):
+        return hashlib.sha1(json.dumps(self.params, default = str).encode()).hexdigest()
+
+    def stamp(self):
+        """record the params the outputs were just made with"""
+        os.makedirs(stamp_dir, exist_ok = True)
+        with open(self._stamp_file(), 'w') as f:
+            json.dump(dict(params = self._params_hash()), f)
+
+    def up_to_date(self):
+        if self.always or not self.outputs or not all(os.path.exists(f) for f in self.outputs):
+            return False
+
+        try:
+            with open(self._stamp_file()) as f:
+                if json.load(f).get('params') != self._params_hash():
+                    return False
+        except (OSError, ValueError):
+            return False
+
+        return min(map(os.path.getmtime, self.outputs)) >= max(map(os.path.getmtime, self.inputs), default = 0)
+
+
+#####
+# TASK FUNCTIONS
+#####
+
+# module level, and importing their modules when run, so process pool workers can take them
+
+def _covid_fetch():
+    import covid_nyt
+    covid_nyt.get_raw()
+
+
+def _covid_clean():
+    # fills the build cache that covid.sample and catalog load from
+    import covid_nyt
+    covid_nyt.load_project_data()
+
+
+def _covid_sample(n, seed, formats):
+    import covid_nyt
+    os.makedirs(covid_out, exist_ok = True)
+    covid_nyt.sample_and_dump(covid_nyt.load_project_data(), n, seed = seed, formats = formats)
+
+
+def _fred_index(key):
+    # saved only when discovery changed it, so fred.sample isn't rerun for nothing
+    import fredapi
+    index = fredapi.SeriesIndex(fredapi.index_file)
+    before = index.data.copy()
+    index.update(fredapi.discover_series(key, [v['tags'] for v in fredapi.indicators.values()]))
+    if not os.path.exists(index.path) or not index.data.reset_index(drop = True).equals(before.reset_index(drop = True)):
+        index.save()
+
+
+def _fred_sample(key, n, seed, formats):
+    import fredapi
+    os.makedirs(fred_out, exist_ok = True)
+    fredapi.get_and_dump(key, n, fred_out, formats = formats, seed = seed, discover = False)
+
+
+def _canopy_clean(formats):
+    import canopy
+    os.makedirs(canopy_out, exist_ok = True)
+    shapes = None if canopy.shapes_file is None else canopy.read_shapes(canopy.shapes_file)
+    canopy.clean_and_dump(canopy.sources, canopy.county_area, formats = formats, shapes = shapes)
+
+
+def _canopy_plot():
+    import canopy
+    os.makedirs(canopy_out, exist_ok = True)
+    shapes = None if canopy.shapes_file is None else canopy.read_shapes(canopy.shapes_file)
+    canopy.plot_canopies(canopy.files_tif, canopy_out, shapes = shapes)
+
+
+def _salaries_clean(formats):
+    import salaries
+    os.makedirs(salaries_out, exist_ok = True)
+    salaries.clean_and_dump(salaries.raw_file, formats = formats)
+
+
+def _catalog():
+    import catalog
+    import canopy
+    import salaries
+    import covid_nyt
+
+    cat = catalog.Catalog()
+    try:
+        cat.ingest_salaries(salaries.load_salaries(salaries.raw_file), salaries.export_date)
+
+        hists, _ = canopy.county_histograms(canopy.sources, canopy.county_area)
+        for k, h in hists.items():
+            cat.ingest_canopy(h, k)
+
+        if os.path.exists('raw/covid_nyt.csv'):
+            d = covid_nyt.load_project_data()
+            cat.ingest_covid(d, vintage = str(d.last_record_on.max().date()))
+    finally:
+        cat.close()
+
+
+def tasks(n, seed = None, formats = ('csv', 'xlsx'), get = False, fred_key = None, catalog = False):
+    """the task graph for a refresh with n students, see module description"""
+    import canopy
+    import salaries
+
+    # the order of formats doesn't change the outputs, so it shouldn't change the params either
+    formats = sorted(formats)
+    covid_raw = ['raw/covid_nyt.csv', 'raw/maskuse_nyt.csv']
+    canopy_sources = sorted(set(canopy.sources.values()))
+
+    t = []
+
+    if get:
+        t.append(Task('covid.fetch', _covid_fetch, modules = ['covid_nyt']))
+
+    t += [Task('covid.clean', _covid_clean, deps = ['covid.fetch'] if get else [], pool = 'process', inputs = covid_raw,
+               modules = ['covid_nyt', 'buildcache']),
+          Task('covid.sample', _covid_sample, args = (n, seed, formats), deps = ['covid.clean'], inputs = covid_raw,
+               outputs = [f'{covid_out}/CV_manifest.csv'], modules = ['covid_nyt', 'sampling', 'util']),
+          Task('canopy.clean', _canopy_clean, args = (formats,), inputs = canopy_sources + [canopy.counties_file],
+               outputs = [f'{canopy_out}/canopy.{f}' for f in formats], modules = ['canopy', 'util']),
+          Task('canopy.plot', _canopy_plot, inputs = sorted(set(canopy.files_tif.values())),
+               outputs = [f'{canopy_out}/{k}.jpeg' for k in canopy.files_tif], modules = ['canopy']),
+          Task('salaries.clean', _salaries_clean, args = (formats,), pool = 'process', inputs = [salaries.raw_file],
+               outputs = [f'{salaries_out}/salaries.{f}' for f in formats], modules = ['salaries', 'util'])]
+
+    if fred_key is not None:
+        import fredapi
+
+        # the key is left out of params, so it isn't written to disk and changing it doesn't rerun anything
+        t += [Task('fred.index', _fred_index, args = (fred_key,), outputs = [fredapi.index_file], modules = ['fredapi'],
+                   params = (), always = True),
+              Task('fred.sample', _fred_sample, args = (fred_key, n, seed, formats), deps = ['fred.index'],
+                   inputs = [fredapi.index_file], outputs = [f'{fred_out}/FRED_manifest.csv'],
+                   modules = ['fredapi', 'sampling', 'util'], params = (n, seed, formats))]
+
+    if catalog:
+        t.append(Task('catalog', _catalog, deps = ['covid.clean', 'canopy.clean', 'salaries.clean'], pool = 'main',
+                      modules = ['catalog']))
+
+    return t
+
+
+#####
+# RUN
+#####
+
+def _check(graph):
+    names = {t.name for t in graph}
+    for t in graph:
+        unknown = [d for d in t.deps if d not in names]
+        if unknown:
+            raise ValueError(f'{t.name} depends on unknown tasks {unknown}')
+
+    # every task reachable in dependency order, else there is a cycle
+    done, left = set(), list(graph)
+    while left:
+        ready = [t for t in left if all(d in done for d in t.deps)]
+        if not ready:
+            raise ValueError(f'dependency cycle among {[t.name for t in left]}')
+        done.update(t.name for t in ready)
+        left = [t for t in left if t.name not in done]
+
+
+def run(graph, force = False, dry_run = False, threads = 8, processes = None):
+    """run graph, see module description. returns {task name: dict(status, seconds, start, end)}"""
+    _check(graph)
+
+    by_name = {t.name: t for t in graph}
+    report = {}
+    t0 = time.perf_counter()
+
+    def settle(t, status, start = None, end = None):
+        start = time.perf_counter() - t0 if start is None else start
+        report[t.name] = dict(status = status, pool = t.pool, start = start, end = start if end is None else end)
+
+    with ThreadPoolExecutor(max_workers = threads) as tpool, ProcessPoolExecutor(max_workers = processes) as ppool:
+        running = {}
+
+        while len(report) + len(running) < len(graph) or running:
+            for t in graph:
+                if t.name in report or t.name in running.values():
+                    continue
+                if not all(d in report for d in t.deps):
+                    continue
+
+                if any(report[d]['status'] not in ('ran', 'skipped', 'dry run', 'missing inputs') for d in t.deps):
+                    settle(t, 'blocked')
+                elif t.missing():
+                    settle(t, 'missing inputs')
+                elif not force and t.up_to_date():
+                    settle(t, 'skipped')
+                elif dry_run:
+                    settle(t, 'dry run')
+                else:
+                    start = time.perf_counter() - t0
+                    if t.pool == 'main':
+                        try:
+                            t.fn(*t.args)
+                            t.stamp()
+                            settle(t, 'ran', start, time.perf_counter() - t0)
+                        except Exception as e:
+                            settle(t, f'failed: {type(e).__name__}: {e}', start, time.perf_counter() - t0)
+                        continue
+
+                    f = (ppool if t.pool == 'process' else tpool).submit(t.fn, *t.args)
+                    f.start = start
+                    running[f] = t.name
+
+            if not running:
+                continue
+
+            finished, _ = wait(list(running), return_when = FIRST_COMPLETED)
+            for f in finished:
+                t = by_name[running.pop(f)]
+                try:
+                    f.result()
+                    t.stamp()
+                    settle(t, 'ran', f.start, time.perf_counter() - t0)
+                except Exception as e:
+                    settle(t, f'failed: {type(e).__name__}: {e}', f.start, time.perf_counter() - t0)
+
+    return report
+
+
+def critical_path(graph, report):
+    """(seconds, task names) of the chain of dependencies with the longest total run time"""
+    by_name = {t.name: t for t in graph}
+    memo = {}
+
+    def longest(name):
+        if name not in memo:
+            r = report.get(name, {})
+            own = r.get('end', 0) - r.get('start', 0)
+            best = max((longest(d) for d in by_name[name].deps), default = (0, []))
+            memo[name] = (best[0] + own, best[1] + [name])
+        return memo[name]
+
+    return max((longest(t.name) for t in graph), default = (0, []))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser('Refresh every STOR155 dataset as one dependency graph. run from the repository root')
+    parser.add_argument('n', type = int, help = 'number of datasets to sample, equal to number of students')
+    parser.add_argument('--get', action = 'store_true', help = 'download the NYT data first')
+    parser.add_argument('--fred-key', type = str, default = None, help = 'FRED api key, the FRED tasks only run with one')
+    parser.add_argument('--catalog', action = 'store_true', help = 'load the cleaned data into the sqlite catalog')
+    parser.add_argument('--seed', type = int, default = None, help = 'seed for the samples, recorded in their manifests either way')
+    parser.add_argument('--formats', nargs = '+', default = ['csv', 'xlsx'], help = 'output formats, any of csv xlsx parquet feather')
+    parser.add_argument('--only', nargs = '+', default = None, help = 'run only tasks starting with these, e.g. covid canopy')
+    parser.add_argument('--force', action = 'store_true', help = 'run tasks even when their outputs are up to date')
+    parser.add_argument('--dry-run', action = 'store_true', help = 'report what would run without running it')
+    parser.add_argument('--threads', type = int, default = 8)
+    parser.add_argument('--processes', type = int, default = None, help = 'default one per core')
+
+    args = parser.parse_args()
+
+    graph = tasks(args.n, seed = args.seed, formats = args.formats, get = args.get, fred_key = args.fred_key, catalog = args.catalog)
+
+    if args.only is not None:
+        keep = {t.name for t in graph if any(t.name.startswith(p) for p in args.only)}
+        # with the tasks they depend on
+        for t in reversed(graph):
+            if t.name in keep:
+                keep.update(t.deps)
+        graph = [t for t in graph if t.name in keep]
+
+    t = time.perf_counter()
+    report = run(graph, force = args.force, dry_run = args.dry_run, threads = args.threads, processes = args.processes)
+    wall = time.perf_counter() - t
+
+    for name, r in report.items():
+        print(f"{name:16s} {r['pool']:8s} {r['end'] - r['start']:8.1f}s  {r['status']}")
+
+    seconds, path = critical_path(graph, report)
+    print(f'wall {wall:.1f}s, critical path {seconds:.1f}s: {" -> ".join(path)}')
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+memoization of cleaning stages on the content of their inputs
+
+a stage decorated with memoize is keyed on
+    * the content hash of every argument named in files (a path, or a list/dict of paths)
+    * the pickled value of every other argument, except those named in ignore
+    * the content hash of the module file defining the stage, so editing the code invalidates it
+and its result is pickled to cache_dir. a rerun with the same key loads that instead of recomputing.
+
+file hashes are remembered by (path, size, mtime), so unchanged raw files are not re-read either.
+the cache is kept under max_bytes by dropping least recently used results. invalidate() clears it explicitly,
+and enabled = False bypasses it.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import inspect
+import threading
+import pandas as pd
+from functools import wraps
+
+
+cache_dir = 'raw/.buildcache'
+max_bytes = 2 * 2**30
+enabled = True
+
+_hashes_file = 'hashes.json'
+_hashes = {}
+# file_hash is called from the build's worker threads
+_hashes_lock = threading.Lock()
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return f'{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}'
+
+
+def _read_hashes():
+    try:
+        with open(os.path.join(cache_dir, _hashes_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def file_hash(path):
+    """sha1 of the file at path. reuses the hash stored for the same path, size and mtime"""
+    key = _stat_key(path)
+
+    with _hashes_lock:
+        if not _hashes:
+            _hashes.update(_read_hashes())
+        if key in _hashes:
+            return _hashes[key]
+
+    # hashed outside the lock, so other threads aren't held up by a large file
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**22), b''):
+            h.update(block)
+
+    with _hashes_lock:
+        # other processes may have stored hashes since this one read the file, so they are merged in rather than
+        # overwritten, and the file is replaced whole so a reader never sees it half written
+        _hashes.update({**_read_hashes(), **_hashes, key: h.hexdigest()})
+
+        os.makedirs(cache_dir, exist_ok = True)
+        file = os.path.join(cache_dir, _hashes_file)
+        part = f'{file}.{os.getpid()}.part'
+        with open(part, 'w') as f:
+            json.dump(_hashes, f)
+        os.replace(part, file)
+
+        return _hashes[key]
+
+
+def _paths_hash(v):
+    # a path, or a list or dict of them
+    if isinstance(v, dict):
+        return {k: _paths_hash(p) for k, p in sorted(v.items())}
+    if isinstance(v, (list, tuple)):
+        return [_paths_hash(p) for p in v]
+    return None if v is None else file_hash(v)
+
+
+def memoize(stage = None, files = (), ignore = ()):
+    """decorator caching the result of a stage, see module description.
+    stage names the cache entries (defaults to file.function), files and ignore are argument names"""
+
+    def decorator(f):
+        source = inspect.getsourcefile(f)
+        name = stage or f'{os.path.splitext(os.path.basename(source))[0]}.{f.__name__}'
+        sig = inspect.signature(f)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return f(*args, **kwargs)
+
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+
+            h = hashlib.sha1(file_hash(source).encode())
+            for k, v in bound.arguments.items():
+                if k in ignore:
+                    continue
+                h.update(k.encode())
+                h.update(json.dumps(_paths_hash(v)).encode() if k in files else pickle.dumps(v))
+
+            path = os.path.join(cache_dir, f'{name}-{h.hexdigest()}.pkl')
+
+            if os.path.exists(path):
+                os.utime(path)
+                return pd.read_pickle(path)
+
+            out = f(*args, **kwargs)
+
+            os.makedirs(cache_dir, exist_ok = True)
+            pd.to_pickle(out, path + '.part')
+            os.replace(path + '.part', path)
+            evict()
+
+            return out
+
+        return wrapper
+
+    return decorator
+
+
+def _entries():
+    if not os.path.isdir(cache_dir):
+        return []
+    return [e for e in os.scandir(cache_dir) if e.name.endswith('.pkl')]
+
+
+def evict():
+    """drop least recently used results until the cache is under max_bytes"""
+    entries = sorted(_entries(), key = lambda e: e.stat().st_mtime)
+    total = sum(e.stat().st_size for e in entries)
+
+    for e in entries:
+        if total <= max_bytes:
+            break
+        total -= e.stat().st_size
+        os.remove(e.path)
+
+
+def invalidate(stage = None):
+    """remove cached results of stage (as named in memoize), or everything"""
+    for e in _entries():
+        if stage is None or e.name.startswith(f'{stage}-'):
+            os.remove(e.path)
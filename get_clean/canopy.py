@@ -13,22 +13,54 @@ NCLD 2016 US Forest Service tree canopy cover estimates
         - Count: number of 30m^2 cells with given Value of coverage
 """
 
+import os
 import re
-import rasterio
+import csv
+import json
+import math
 import pandas as pd
 import numpy as np
-import rasterio.plot as rioplt
-import matplotlib.pyplot as plt
-from dbfread import DBF
+import util
+import buildcache
+import instrument
 from functools import wraps
+from concurrent.futures import ProcessPoolExecutor
 
 ### FILEPATHS AND PROPCO
 
-files = {'durham': 'raw/ncld_canopy/durham_canopy.dbf', 'orange': 'raw/ncld_canopy/orange_canopy.dbf'}
-files_tif = {k: v.replace(".dbf", ".tif") for k, v in files.items()}
+# counties are configured in counties_file, one row each: county, area (land km^2), dbf, tif (paths from the repository root).
+# adding a county is adding a row. blank dbf or area is fine for counties only available as rasters.
+# tif can be the same large raster for every county, when shapes_file has their boundaries to clip it with.
+counties_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'raw', 'ncld_canopy', 'counties.csv')
 
-# TODO remove this aspect of the api once zero-deflation no longer needed
-county_area =  {'durham': 722, 'orange': 1039}
+# optional GeoJSON FeatureCollection of county boundaries, in the raster crs, with the county name in properties['county']
+shapes_file = None
+
+
+def read_counties(file = counties_file):
+    """sources, files_tif and county_area dicts from the county config, see counties_file. sources has one file per
+    county, its dbf if it has one and otherwise its tif, for clean_and_dump and county_histograms"""
+    with open(file, newline = '') as f:
+        rows = list(csv.DictReader(f))
+
+    sources = {r['county']: r.get('dbf') or r['tif'] for r in rows if r.get('dbf') or r.get('tif')}
+    files_tif = {r['county']: r['tif'] for r in rows if r.get('tif')}
+    county_area = {r['county']: int(r['area']) for r in rows if r.get('area')}
+
+    return sources, files_tif, county_area
+
+
+def read_shapes(file, name = 'county'):
+    """dict of county name to boundary geometry from a GeoJSON FeatureCollection"""
+    with open(file) as f:
+        features = json.load(f)['features']
+
+    return {ft['properties'][name]: ft['geometry'] for ft in features}
+
+
+sources, files_tif, county_area = read_counties()
+
+# TODO remove county_area from the api once zero-deflation no longer needed
 
 
 # prop_co = {'durham': 0.65 * 0.18222222222222165, 'orange': 0.65 * 0.20740740740740712}
@@ -36,26 +68,105 @@ county_area =  {'durham': 722, 'orange': 1039}
 
 ### PLOTTERS
 # students won't use the data. just for hw prompt display
+# rasterio, matplotlib and dbfread are imported where used, so importing canopy for the data doesn't load them
+
+def plot_canopy(file, outfile, dpi = 300, max_size = 2048, shape = None):
+    """render the raster at file, or just the county in shape, decimated to at most max_size cells on a side.
+    the read uses out_shape, so GDAL serves it from overviews where the file has them and memory stays bounded."""
+    import rasterio
+    import rasterio.features
+    import matplotlib.pyplot as plt
 
-def plot_canopy(file, outfile, dpi = 300):
     with rasterio.open(file) as r:
-        plt.figure(figsize=(12, 12))
+        window = None if shape is None else rasterio.features.geometry_window(r, [shape])
+        height, width = (r.height, r.width) if window is None else (window.height, window.width)
+        step = max(1, math.ceil(max(height, width) / max_size))
+
+        a = r.read(1, window = window, out_shape = (math.ceil(height / step), math.ceil(width / step)), masked = True)
+
+        if shape is not None:
+            # blank out what lies outside the county, on the decimated grid
+            transform = r.window_transform(window) * rasterio.Affine.scale(width / a.shape[1], height / a.shape[0])
+            a = np.ma.masked_array(a, mask = np.ma.getmaskarray(a) | rasterio.features.geometry_mask([shape], out_shape = a.shape, transform = transform))
+
+        fig = plt.figure(figsize=(12, 12))
         plt.axis("off")
-        plt.imshow(r.read(1), cmap = "Greens")
+        plt.imshow(a, cmap = "Greens")
         plt.savefig(outfile, dpi = dpi, pad_inches = 0, transparent = True, bbox_inches = "tight")
-        
+        plt.close(fig)
 
-### GETTERS
 
-# TODO update to act on raw dataset (largeish) or on tif files, not on arcgis exported attribute tables
+def plot_canopies(files_tif, outdir, shapes = None, workers = None, **kwargs):
+    """plot_canopy for each county in files_tif to outdir/county.jpeg, across workers processes. kwargs go to plot_canopy"""
+    shapes = shapes or {}
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        done = [pool.submit(plot_canopy, f, f"{outdir}/{k}.jpeg", shape = shapes.get(k), **kwargs) for k, f in files_tif.items()]
+        for d in done:
+            d.result()
+
+
+### GETTERS
 
 def dbf_to_df(file):
     """Read ArcGIS attribute tables as dbf files and convert to data frames"""
+    from dbfread import DBF
     d = DBF(file)
     d = pd.DataFrame(d.records)
     return d
 
 
+def _tiles(window, height, width):
+    # window split into pieces of at most height x width
+    import rasterio.windows
+    for row in range(0, window.height, height):
+        for col in range(0, window.width, width):
+            yield rasterio.windows.Window(window.col_off + col, window.row_off + row,
+                                          min(width, window.width - col), min(height, window.height - row))
+
+
+def tif_to_df(file, shape = None, nodata = None, band = 1, tile = 1024):
+    """Value counts of a raster, in the same Value/Count layout as dbf_to_df, for the county tifs or the full CONUS raster.
+
+    the raster is read a tile at a time (tile x tile cells, rounded up to whole internal blocks), so memory is bounded
+    whatever the raster size. nodata cells (the file's nodata value unless nodata is given) are not counted.
+    shape is an optional GeoJSON-like geometry in the raster's crs, e.g. a county boundary: only the window around it
+    is read and cells whose centers fall outside it are not counted. that excludes the border cells exactly,
+    so no zero-deflation is needed."""
+    import rasterio
+    import rasterio.features
+    import rasterio.windows
+
+    with rasterio.open(file) as r:
+        nodata = r.nodata if nodata is None else nodata
+
+        if shape is None:
+            window = rasterio.windows.Window(0, 0, r.width, r.height)
+        else:
+            window = rasterio.features.geometry_window(r, [shape])
+
+        bh, bw = r.block_shapes[band - 1]
+        counts = np.zeros(0, dtype = 'int64')
+
+        for w in _tiles(window, bh * math.ceil(tile / bh), bw * math.ceil(tile / bw)):
+            a = r.read(band, window = w)
+            keep = np.ones(a.shape, dtype = bool) if nodata is None else a != nodata
+
+            if shape is not None:
+                keep &= rasterio.features.geometry_mask([shape], out_shape = a.shape, transform = r.window_transform(w), invert = True)
+
+            c = np.bincount(a[keep].astype('int64').ravel())
+            if c.size > counts.size:
+                c[:counts.size] += counts
+                counts = c
+            else:
+                counts[:c.size] += c
+
+    value = np.flatnonzero(counts)
+
+    return pd.DataFrame({'Value': value, 'Count': counts[value]})
+
+
 ### DATA PROCESS
 
 
@@ -87,6 +198,7 @@ def _extract_county(file):
 def standardize(f):
     
     @wraps(f)
+    @instrument.stage(f, 'standardize')
     def wrapper(**kwargs):
         if type(kwargs['data']) != pd.core.frame.DataFrame:
             raise TypeError("'data' must be a data frame")
@@ -116,27 +228,153 @@ def unpack(data = None, county_area = 0):
     return data
 
 
+class Histogram:
+    """Compact stand-in for the one-row-per-cell data from unpack: keeps the (value, count) table and
+    draws cells uniformly from it, so memory is O(distinct values) rather than O(cells).
+
+    data is a data frame with a 'count' column. every other column is a key, e.g. value, or value and county
+    for several counties stacked, and sampled rows carry those columns."""
+
+    def __init__(self, data):
+        self.data = data.loc[data.loc[:, "count"] > 0].reset_index(drop = True)
+        self.keys = [c for c in self.data.columns if c != "count"]
+        self._counts = self.data.loc[:, "count"].to_numpy(dtype = "int64")
+        self._cum = np.cumsum(self._counts)
+
+    @property
+    def cells(self):
+        """number of raster cells represented"""
+        return int(self._cum[-1]) if self._cum.size else 0
+
+    def _rows(self, ids):
+        return self.data.loc[:, self.keys].take(ids).reset_index(drop = True)
+
+    def sample(self, n, replace = True, seed = None):
+        """n cells drawn uniformly, as rows of the key columns. same distribution as sampling rows from unpack.
+        with replacement each draw is a cell number located in the cumulative counts, without replacement the
+        per-row counts are multivariate hypergeometric, expanded and shuffled."""
+        rng = np.random.default_rng(seed)
+
+        if replace:
+            ids = np.searchsorted(self._cum, rng.integers(0, self.cells, size = n), side = "right")
+        else:
+            assert n <= self.cells, f"cannot draw {n} cells without replacement from {self.cells}"
+            ids = rng.permutation(np.repeat(self.data.index.to_numpy(), rng.multivariate_hypergeometric(self._counts, n)))
+
+        return self._rows(ids)
+
+    def expand(self, chunksize = 10**6, shuffle = True, seed = None):
+        """full expansion to one row per cell, yielded chunksize rows at a time. shuffled, the chunks
+        together are a uniform random ordering of all cells (each a draw without replacement from what is left),
+        otherwise rows come in data order as from unpack."""
+        rng = np.random.default_rng(seed)
+        left = self._counts.copy()
+        ids = self.data.index.to_numpy()
+
+        for start in range(0, self.cells, chunksize):
+            k = min(chunksize, self.cells - start)
+
+            if shuffle:
+                take = rng.multivariate_hypergeometric(left, k)
+                chunk = rng.permutation(np.repeat(ids, take))
+            else:
+                # first k cells of what is left, in order
+                cum = np.cumsum(left)
+                take = np.minimum(left, np.maximum(k - (cum - left), 0))
+                chunk = np.repeat(ids, take)
+
+            left -= take
+
+            yield self._rows(chunk)
+
+    def describe(self):
+        """cell-weighted summary statistics of value, as a dict"""
+        value = self.data.loc[:, "value"].to_numpy(dtype = "float64")
+        order = np.argsort(value, kind = "stable")
+        cum = np.cumsum(self._counts[order])
+
+        mean = np.average(value, weights = self._counts)
+        out = dict(cells = self.cells, mean = mean, std = np.sqrt(np.average((value - mean) ** 2, weights = self._counts)))
+
+        value = value[order]
+        out.update(min = value[0], max = value[-1])
+
+        for name, q in [("q25", .25), ("median", .5), ("q75", .75)]:
+            out[name] = value[np.searchsorted(cum, q * self.cells)]
+
+        return out
+
+    def to_frame(self, shuffle = True, seed = None):
+        """the whole expansion as one data frame. only when it is really needed"""
+        return pd.concat(self.expand(shuffle = shuffle, seed = seed), ignore_index = True)
+
+
+@standardize
+def histogram(data = None, county_area = None):
+    """data as for unpack, or from tif_to_df. returns the Histogram rather than replicating rows,
+    zero-deflated if county_area is given (only needed for the dbf files)"""
+
+    if county_area is not None:
+        data = _deflate_zeros(data, county_area)
+
+    return Histogram(data)
+
+
+def read_counts(file, shape = None):
+    """dbf_to_df or tif_to_df depending on the file extension. shape only applies to rasters"""
+    return dbf_to_df(file) if file.endswith('.dbf') else tif_to_df(file, shape = shape)
+
+
+def _county_histogram(file, shape, county_area):
+    # one county for county_histograms, in a worker process
+    h = histogram(data = read_counts(file, shape = shape), county_area = county_area if file.endswith('.dbf') else None)
+    return h.data, h.describe()
+
+
+@buildcache.memoize(files = ['files'], ignore = ['workers'])
+def _county_tables(files, county_area, shapes, workers):
+    # plain data frames rather than Histograms, so the cached result does not depend on this module's name
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        done = {k: pool.submit(_county_histogram, f, shapes.get(k), county_area.get(k)) for k, f in files.items()}
+        done = {k: d.result() for k, d in done.items()}
+
+    tables = {k: d for k, (d, _) in done.items()}
+    stats = pd.DataFrame([dict(county = k, **s) for k, (_, s) in done.items()])
+
+    return tables, stats
+
+
+def county_histograms(files, county_area = None, shapes = None, workers = None):
+    """histogram and summary statistics for each county in files (dbf or tif paths, as for clean_and_dump),
+    computed across workers processes. returns a dict of Histogram by county and a data frame of the summaries.
+    results are cached on the content of the files, see buildcache."""
+    tables, stats = _county_tables(files, county_area or {}, shapes or {}, workers)
+
+    return {k: Histogram(d) for k, d in tables.items()}, stats
+
+
 
 ### OUT
 
-def clean_and_dump(files, county_area):
-    """Gets data from a list of dbf files, processes with unpack, adds a county identifier column and row-binds before writing csv and xlsx.
-    files is a dict where keys are county names and values are .dbf file paths
-    county_area is a dict with county names and land areas needed for zero-deflation. see module description."""
+def clean_and_dump(files, county_area = None, formats = ('csv', 'xlsx'), shapes = None, workers = None):
+    """Gets data from a list of dbf or tif files, builds a histogram for each, adds a county identifier column and row-binds before writing
+    the shuffled one-row-per-cell expansion in each of formats. the expansion is streamed in chunks, never held in full.
+    files is a dict where keys are county names and values are .dbf or .tif file paths, the tifs possibly all the same large raster
+    county_area is a dict with county names and land areas needed for zero-deflation of the dbf files. see module description.
+    shapes is an optional dict with county names and boundary geometries to clip the tifs to, see tif_to_df.
+    formats are any of the keys in util.writers. xlsx output is truncated to the rows excel can hold.
+    counties are read across workers processes, see county_histograms. returns their summary statistics."""
     
-    d = [unpack(data = dbf_to_df(f), county_area = county_area[k],
-                ).assign(county = k) for k, f in files.items()]
-    
-    # rowbind and shuffle
-    d = pd.concat(d)
-    d = d.sample(d.shape[0]).reset_index(drop = True)
+    hists, stats = county_histograms(files, county_area = county_area, shapes = shapes, workers = workers)
+
+    d = [h.data.assign(county = k) for k, h in hists.items()]
     
-    # write csv
-    d.to_csv('../stor155_sp21/final_project/canopy/canopy.csv', index = False)
+    # rowbind, then shuffle on the way out
+    d = Histogram(pd.concat(d, ignore_index = True))
     
-    # write excel. can't handle more than 1,048,576 rows
-    # https://support.microsoft.com/en-us/office/excel-specifications-and-limits-1672b34d-7043-467e-8e27-269d656771c3
-    d.loc[:1e6].to_excel('../stor155_sp21/final_project/canopy/canopy.xlsx', index = False)
+    util.write_chunks(d.expand(), '../stor155_sp21/final_project/canopy/canopy', formats)
+
+    return stats
 
 
 #####
@@ -144,9 +382,26 @@ def clean_and_dump(files, county_area):
 #####
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser('Clean and write out NLCD canopy cover for STOR155 projects. run from the repository root')
+    parser.add_argument('--rebuild', action = 'store_true', help = 'ignore cached cleaning results')
+    parser.add_argument('--metrics', type = str, default = None, help = 'record stage metrics to this json lines file, see instrument')
+
+    args = parser.parse_args()
+
+    if args.metrics is not None:
+        instrument.enabled = True
+        instrument.log_to(args.metrics)
+
+    if args.rebuild:
+        buildcache.invalidate('canopy._county_tables')
     
-    clean_and_dump(files, county_area)
+    shapes = None if shapes_file is None else read_shapes(shapes_file)
+
+    print(clean_and_dump(sources, county_area, shapes = shapes))
     
-    for k, f in files_tif.items():
-        outfile = f"../stor155_sp21/final_project/canopy/{k}.jpeg"
-        plot_canopy(f, outfile)
\ No newline at end of file
+    plot_canopies(files_tif, "../stor155_sp21/final_project/canopy", shapes = shapes)
+
+    if args.metrics is not None:
+        print(instrument.summary())
\ No newline at end of file
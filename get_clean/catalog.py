@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+"""
+sqlite catalog of the staged datasets, the start of the database the README has in mind
+
+one table per dataset, plus a datasets table recording for each dataset (or part of one, e.g. a FRED series
+or a canopy county) its source, fetch time, vintage, content hash, row count and column dtypes, the last
+so that lookups come back with the same dtypes that went in.
+
+tables and their indexes
+    covid_county: covid_nyt.project_data output, indexed on state and fips
+    fred: fredapi.get_series output in long form (series_id, date, value), indexed on series_id, date
+    canopy: canopy histograms (county, value, count), indexed on county. unpack output is counted back into one
+    salaries: salaries.standardize output plus export_date, indexed on hire_year and home_department
+
+writes are one executemany per dataset inside a transaction. lookups are WHERE clauses on indexed columns.
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import pandas as pd
+
+
+# default database, relative to the repository root
+db_file = 'raw/stor.sqlite'
+
+sources = dict(covid_county = 'https://github.com/nytimes/covid-19-data',
+               fred = 'https://fred.stlouisfed.org',
+               canopy = 'https://www.mrlc.gov/data/nlcd-2016-usfs-tree-canopy-cover-conus',
+               salaries = 'https://uncdm.northcarolina.edu/salaries/index.php')
+
+indexes = dict(covid_county = [['state'], ['fips']],
+               fred = [['series_id', 'date']],
+               canopy = [['county', 'value']],
+               salaries = [['hire_year'], ['home_department'], ['export_date']])
+
+_schema = """
+CREATE TABLE IF NOT EXISTS datasets (
+    name TEXT,
+    part TEXT,
+    source TEXT,
+    fetched_at TEXT,
+    vintage TEXT,
+    content_hash TEXT,
+    rows INTEGER,
+    dtypes TEXT,
+    PRIMARY KEY (name, part)
+);
+"""
+
+
+def content_hash(d):
+    """sha1 of the values and column names of a data frame, independent of its index"""
+    h = pd.util.hash_pandas_object(d, index = False).values.tobytes()
+    return hashlib.sha1(h + json.dumps(list(map(str, d.columns))).encode()).hexdigest()
+
+
+def _sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _object_datetimes(s):
+    # object columns of Timestamps or dates, e.g. covid_by_co last_record_on
+    return pd.api.types.is_object_dtype(s) and pd.api.types.infer_dtype(s, skipna = True) in ('datetime', 'datetime64', 'date')
+
+
+def _dtypes(d):
+    # dtypes recorded for _restore. object columns of datetimes go in as iso text, so they come back as datetime64
+    return {c: 'datetime64[ns]' if _object_datetimes(s) else str(s.dtype) for c, s in d.items()}
+
+
+def _records(d):
+    # python values for executemany: datetimes, including object columns of them, as iso text, missing values as None
+    d = d.copy()
+    for c in d.columns:
+        if _object_datetimes(d[c]):
+            d[c] = pd.to_datetime(d[c])
+        if pd.api.types.is_datetime64_any_dtype(d[c]):
+            d[c] = d[c].dt.strftime('%Y-%m-%d %H:%M:%S').str.replace(' 00:00:00', '', regex = False)
+
+    d = d.astype(object).where(d.notna(), None)
+    return list(d.itertuples(index = False, name = None))
+
+
+class Catalog:
+    """connection to the catalog database at path, created if missing"""
+
+    def __init__(self, path = db_file):
+        self.path = path
+        self.con = sqlite3.connect(path)
+        self.con.executescript(_schema)
+
+    def close(self):
+        self.con.close()
+
+    # WRITE
+
+    def ingest(self, name, d, part = '', replace = None, source = None, vintage = None, fetched_at = None):
+        """bulk insert data frame d into table name, in one transaction.
+
+        replace: dict of column values whose rows are deleted first, e.g. {'series_id': 'GDP'} to refresh a series.
+                 None replaces the whole table.
+        part: label for this piece of the table in the datasets record, e.g. the series id
+        returns the content hash of d"""
+
+        cols = list(d.columns)
+        digest = content_hash(d)
+        fetched_at = fetched_at or time.strftime('%Y-%m-%d %H:%M:%S')
+
+        with self.con:
+            self.con.execute(f'CREATE TABLE IF NOT EXISTS {name} ({", ".join(f"{c} {_sql_type(t)}" for c, t in d.dtypes.items())})')
+
+            for ix in indexes.get(name, []):
+                self.con.execute(f'CREATE INDEX IF NOT EXISTS {name}_{"_".join(ix)} ON {name} ({", ".join(ix)})')
+
+            if replace is None:
+                self.con.execute(f'DELETE FROM {name}')
+                self.con.execute('DELETE FROM datasets WHERE name = ?', (name,))
+            else:
+                where = ' AND '.join(f'{c} = ?' for c in replace)
+                self.con.execute(f'DELETE FROM {name} WHERE {where}', _records(pd.DataFrame([replace]))[0])
+
+            self.con.executemany(f'INSERT INTO {name} ({", ".join(cols)}) VALUES ({", ".join(["?"] * len(cols))})', _records(d))
+
+            self.con.execute('INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (name, part, source or sources.get(name), fetched_at, vintage, digest, d.shape[0],
+                              json.dumps(_dtypes(d))))
+
+        return digest
+
+    def ingest_covid(self, d, vintage = None):
+        """covid_nyt.project_data output. vintage e.g. the last record date"""
+        return self.ingest('covid_county', d, vintage = vintage)
+
+    def ingest_fred(self, d, vintage = None):
+        """fredapi.get_series output, a date column and one column named for the series. vintage e.g. its last_updated"""
+        series_id = [c for c in d.columns if c != 'date'][0]
+        d = d.rename(columns = {series_id: 'value'}).assign(series_id = series_id).loc[:, ['series_id', 'date', 'value']]
+
+        return self.ingest('fred', d, part = series_id, replace = {'series_id': series_id}, vintage = vintage)
+
+    def ingest_canopy(self, d, county):
+        """a canopy.Histogram, its data, or canopy.unpack output (counted back into a histogram) for county"""
+        d = getattr(d, 'data', d)
+        if 'count' not in d.columns:
+            d = d.value.value_counts(sort = False).sort_index().rename_axis('value').reset_index(name = 'count')
+
+        d = d.loc[:, ['value', 'count']].assign(county = county).loc[:, ['county', 'value', 'count']]
+
+        return self.ingest('canopy', d, part = county, replace = {'county': county})
+
+    def ingest_salaries(self, d, export_date):
+        """salaries.standardize output for the snapshot exported on export_date (yyyy-mm-dd)"""
+        d = d.assign(export_date = export_date)
+
+        return self.ingest('salaries', d, part = export_date, replace = {'export_date': export_date}, vintage = export_date)
+
+    # READ
+
+    def datasets(self):
+        """the datasets table"""
+        return pd.read_sql_query('SELECT * FROM datasets ORDER BY name, part', self.con)
+
+    def lookup(self, name, columns = None, **where):
+        """rows of table name matching where (column = value, or column = list of values), restored to
+        their ingested dtypes. filter on indexed columns to keep it an index scan."""
+
+        clauses, params = [], []
+        for c, v in where.items():
+            if isinstance(v, (list, tuple, set)):
+                clauses.append(f'{c} IN ({", ".join(["?"] * len(v))})')
+                params.extend(v)
+            else:
+                clauses.append(f'{c} = ?')
+                params.append(v)
+
+        sql = f'SELECT {", ".join(columns) if columns else "*"} FROM {name}'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+
+        d = pd.read_sql_query(sql, self.con, params = params)
+
+        return self._restore(name, d)
+
+    def _restore(self, name, d):
+        dtypes = {}
+        for (raw,) in self.con.execute('SELECT dtypes FROM datasets WHERE name = ?', (name,)):
+            dtypes.update(json.loads(raw))
+
+        for c, t in dtypes.items():
+            if c not in d.columns:
+                continue
+            if t.startswith('datetime64'):
+                # dates at midnight are stored without the time, so a column can mix the two forms
+                d[c] = pd.to_datetime(d[c], format = 'ISO8601')
+            elif t != 'object':
+                d[c] = d[c].astype(t)
+
+        return d
+
+    def covid(self, state = None, fips = None):
+        where = {k: v for k, v in dict(state = state, fips = fips).items() if v is not None}
+        return self.lookup('covid_county', **where)
+
+    def fred(self, series_id):
+        """one or more series in long form"""
+        return self.lookup('fred', series_id = series_id)
+
+    def canopy(self, county = None):
+        return self.lookup('canopy', **({} if county is None else dict(county = county)))
+
+    def salaries(self, hire_year = None, export_date = None):
+        where = {k: v for k, v in dict(hire_year = hire_year, export_date = export_date).items() if v is not None}
+        return self.lookup('salaries', **where)
+
+
+#####
+#RUN
+#####
+
+if __name__ == "__main__":
+    import os
+    import glob
+    import argparse
+
+    import canopy
+    import salaries
+    import covid_nyt
+
+    parser = argparse.ArgumentParser('Load the staged datasets from raw/ into the sqlite catalog. run from the repository root')
+    parser.add_argument('--db', type = str, default = db_file, help = 'catalog database file')
+    parser.add_argument('--fred-store', type = str, default = None, help = 'directory of series csvs kept by fredapi.update_series')
+
+    args = parser.parse_args()
+
+    cat = Catalog(args.db)
+
+    cat.ingest_salaries(salaries.standardize(salaries.get_salaries(salaries.raw_file)), salaries.export_date)
+
+    hists, _ = canopy.county_histograms(canopy.sources, canopy.county_area)
+    for k, h in hists.items():
+        cat.ingest_canopy(h, k)
+
+    if os.path.exists('raw/covid_nyt.csv'):
+        d = covid_nyt.project_data(county = 'raw/covid_nyt.csv', masks = pd.read_csv('raw/maskuse_nyt.csv'))
+        cat.ingest_covid(d, vintage = str(d.last_record_on.max().date()))
+
+    if args.fred_store is not None:
+        for f in glob.glob(f'{args.fred_store}/*.csv'):
+            cat.ingest_fred(pd.read_csv(f, parse_dates = ['date']))
+
+    print(cat.datasets())
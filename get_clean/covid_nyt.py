@@ -21,7 +21,14 @@ FREQUENTLY: The estimated share of people in this county who would say frequentl
 ALWAYS: The estimated share of people in this county who would say always
 """
 
+import io
+import os
+import json
 import pandas as pd
+import util
+import sampling
+import buildcache
+import instrument
 from functools import wraps
 
 
@@ -29,22 +36,145 @@ from functools import wraps
 # GETTERS
 #######
 
-def get_raw():
-
-    base = 'https://github.com/nytimes/covid-19-data/raw/master/'
-    url = dict(maskuse = 'mask-use/mask-use-by-county',
+# point base at a local file server for testing
+base = 'https://github.com/nytimes/covid-19-data/raw/master/'
+sources = dict(maskuse = 'mask-use/mask-use-by-county',
                 covid = 'us-counties', univ_covid = 'colleges/colleges')
 
-    url = {k: base + p + '.csv' for k, p in url.items()}
+# ETag/Last-Modified of the last download of each source, for conditional requests
+validators_file = 'raw/nyt_validators.json'
+
+# per county aggregate of by_co_source kept up to date by get_raw, see covid_by_co
+by_co_source = 'raw/covid_nyt.csv'
+by_co_file = 'raw/covid_nyt_by_co.pkl'
+
+
+def _download(r, out):
+    # the body of response r to out, replacing it only once complete
+    with open(out + '.part', 'wb') as f:
+        for block in r.iter_content(2**20):
+            f.write(block)
+    os.replace(out + '.part', out)
+
+
+def get_raw(base = base, incremental = True):
+    """download the NYT csvs to raw/{k}_nyt.csv for k in sources.
+
+    requests are conditional on the validators from the last download, so unchanged files are skipped.
+    with incremental, an existing us-counties file is treated as append-only: only the bytes from its last line
+    on are requested, the rows after it appended, and folded into the per county aggregate at by_co_file.
+    if the served file no longer lines up with the local one it is downloaded whole.
+    that misses NYT revisions to earlier dates, pass incremental = False to rewrite everything."""
+    import requests
+
+    url = {k: base + p + '.csv' for k, p in sources.items()}
+
+    validators = {}
+    if os.path.exists(validators_file):
+        with open(validators_file) as f:
+            validators = json.load(f)
 
     for k, u in url.items():
         try:
             out = f'raw/{k}_nyt.csv'
-            d = pd.read_csv(u)
-            d.to_csv(out, index = False)
-        except:
+
+            headers = {}
+            if incremental and os.path.exists(out):
+                v = validators.get(k, {})
+                if v.get('etag'):
+                    headers['If-None-Match'] = v['etag']
+                if v.get('last_modified'):
+                    headers['If-Modified-Since'] = v['last_modified']
+
+            ranged = k == 'covid' and incremental and os.path.exists(out)
+            if ranged:
+                headers['Range'] = f'bytes={_last_line(out)[0]}-'
+
+            with requests.get(u, headers = headers, stream = True) as r:
+                if r.status_code == 304:
+                    continue
+
+                if r.status_code != 416:
+                    r.raise_for_status()
+
+                appended = ranged and _append_covid(r, out)
+                if not appended and r.status_code == 200:
+                    _download(r, out)
+
+            if not appended and r.status_code != 200:
+                # a range that didn't line up, download the whole file
+                with requests.get(u, stream = True) as r:
+                    r.raise_for_status()
+                    _download(r, out)
+
+            if not appended and k == 'covid':
+                pd.to_pickle(covid_by_co_stream(out), by_co_file)
+
+            validators[k] = dict(etag = r.headers.get('ETag'), last_modified = r.headers.get('Last-Modified'))
+        except (requests.RequestException, OSError):
+            # a source that can't be fetched is left as it was
             continue
 
+    with open(validators_file, 'w') as f:
+        json.dump(validators, f, indent = 1)
+
+
+def _last_line(file):
+    # (byte offset, contents) of the last line, read from the end of the file
+    with open(file, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(max(size - 4096, 0))
+        tail = f.read()
+
+    body = tail.rstrip(b'\r\n')
+    start = body.rfind(b'\n') + 1
+
+    return size - len(tail) + start, body[start:]
+
+
+def _append_covid(r, out):
+    """append the rows of response r dated after the last row of out, and update by_co_file with them.
+    the csv is sorted by date, so only the date prefix of each line is compared and old rows are never parsed.
+
+    r is either the whole file, or a range from the last line of out on. False, with nothing written,
+    when the range doesn't start with that line, i.e. the file was rewritten rather than appended to."""
+    last = _last_line(out)[1]
+
+    lines = r.iter_lines()
+    if r.status_code == 416 or (r.status_code == 206 and next(lines, None) != last):
+        return False
+
+    if r.status_code == 206:
+        with open(out, 'rb') as f:
+            header = f.readline().rstrip(b'\r\n')
+    else:
+        header = next(lines)
+
+    new = [line for line in lines if line[:10] > last[:10]]
+
+    if not new:
+        return True
+
+    with open(out, 'rb+') as f:
+        f.seek(-1, 2)
+        sep = b'' if f.read(1) == b'\n' else b'\n'
+        f.write(sep + b'\n'.join(new) + b'\n')
+
+    chunk = pd.read_csv(io.BytesIO(b'\n'.join([header] + new)), dtype = covid_dtypes)
+
+    if os.path.exists(by_co_file):
+        pd.to_pickle(_fold_by_co(pd.concat([pd.read_pickle(by_co_file), _by_co_chunk(chunk)], ignore_index = True)), by_co_file)
+    else:
+        pd.to_pickle(covid_by_co_stream(out), by_co_file)
+
+    return True
+
+
+# explicit types for the us-counties file. county and state repeat on every date, so read as categories.
+# cases and deaths are left to inference so the results match reading the whole file at once
+covid_dtypes = {'date': 'object', 'county': 'category', 'state': 'category', 'fips': 'float64'}
+
 
 #######
 # FUNCTIONS
@@ -65,6 +195,7 @@ def _name_fixer(s):
 def standardize(f):
 
     @wraps(f)
+    @instrument.stage(f, 'standardize')
     def wrapper(**kwargs):
         # standard names
         data = kwargs.get('data')
@@ -73,7 +204,7 @@ def standardize(f):
         # Int64 rather than int because pandas implements NaN to pd.NA conversion
         # NOTE: this is experimental https://pandas.pydata.org/pandas-docs/stable/user_guide/integer_na.html
         data.loc[:, data.dtypes == 'object'] = data.loc[:, data.dtypes == 'object'].apply(lambda x: x.str.lower()).values
-        data.loc[:, 'fips'] = data.loc[:, 'fips'].astype("Int64")
+        data['fips'] = data.fips.astype("Int64")
 
         kwargs['data'] = data
         return f(**kwargs)
@@ -87,27 +218,24 @@ def standardize(f):
 # allow file out path to be set in cli?
 # just write to sqlite db in future
 
-def process_dsamples(pathout = '', filepre = ''):
+def process_dsamples(pathout = '', filepre = '', workers = None, formats = ('csv', 'xlsx')):
     def processer(f):
         @wraps(f)
-        def wrapper(*args, **kwargs):
+        @instrument.stage(f, 'process_dsamples')
+        def wrapper(*args, formats = formats, **kwargs):
             out = f(*args, **kwargs)
 
-            # any undesireables?
-            checkna = any([dd.loc[:, 'masks_never':'masks_always'].apply(lambda x: x.notna().sum()).eq(0).any() for dd in out])
+            # any undesireables? an assignment only needs each distinct group checked
+            assigned = isinstance(out, sampling.Assignment)
+            checkna = any([dd.loc[:, 'masks_never':'masks_always'].notna().sum().eq(0).any() for dd in (out.distinct().values() if assigned else out)])
 
             assert not checkna, "NA values discovered in essential data columns, csv not written"
 
-            # write out to csv, with id
-            filecsv = pathout + '/' + filepre + '_{}.csv'
-            filexl = pathout + '/' + filepre + '_{}.xlsx'
-
-            for i, v in enumerate(out):
-                try:
-                    v.to_csv(filecsv.format(i), index = False)
-                    v.to_excel(filexl.format(i), index = False)
-                except:
-                    continue
+            # write out in each of formats, with id, across workers processes. assignments add their manifest
+            if assigned:
+                out.write(pathout, filepre, formats = formats, workers = workers)
+            else:
+                util.write_samples(out, pathout, filepre, formats = formats, workers = workers)
 
         return wrapper
     return processer
@@ -121,63 +249,114 @@ def covid_by_co(data = None):
     data.loc[:, 'county'] = data.loc[:, 'county'].mask(data.county.eq('unknown'), pd.NA)
 
     # cases, deaths are cumulative
-    data = data.groupby(['county', 'state']).agg(cases = ('cases', 'max'),
-    deaths = ('deaths', 'max'), last_record_on = ('date', 'max'),
+    data = _fold_by_co(data.rename(columns = {'date': 'last_record_on'}))
+
+    return data
+
+
+def _fold_by_co(data):
+    # per county max of the cumulative counts and dates, first fips seen.
+    # observed only matters for category keys, as in covid_by_co_stream
+    data = data.groupby(['county', 'state'], observed = True).agg(cases = ('cases', 'max'),
+    deaths = ('deaths', 'max'), last_record_on = ('last_record_on', 'max'),
     fips = ('fips', lambda x: x.iloc[0])).reset_index()
 
     return data
 
+
+def _lower_categories(s):
+    cats = s.cat.categories
+    return s.map(dict(zip(cats, cats.str.lower())))
+
+
+def _by_co_chunk(chunk):
+    # covid_by_co on a chunk read with covid_dtypes, keys back to object for folding
+    chunk = chunk.assign(county = _lower_categories(chunk.county), state = _lower_categories(chunk.state))
+
+    return covid_by_co(data = chunk).astype({'county': 'object', 'state': 'object'})
+
+
+def covid_by_co_stream(file, chunksize = 250000):
+    """covid_by_co for the us-counties csv at file, read chunksize rows at a time.
+
+    each chunk is reduced by covid_by_co and folded into the running per county result, so peak memory
+    is one chunk plus one row per county rather than the whole file. output is the same as
+    covid_by_co(data = pd.read_csv(file))."""
+
+    out = None
+
+    for chunk in pd.read_csv(file, dtype = covid_dtypes, chunksize = chunksize):
+        chunk = _by_co_chunk(chunk)
+
+        # earlier chunks first, so the running fips is kept. folding the first chunk too sorts its keys as object
+        out = chunk if out is None else pd.concat([out, chunk], ignore_index = True)
+        out = _fold_by_co(out)
+
+    return out
+
 # might create categorical variables here later
 @standardize
 def masks_by_co(data = None):
-    data.columns = data.columns.str.replace('([a-z]+)', 'masks_\g<1>')
+    data.columns = data.columns.str.replace('([a-z]+)', r'masks_\g<1>', regex = True)
     data.columns = data.columns.putmask(data.columns == 'masks_fips', 'fips')
     return data
 
 
-def project_data(county = None, masks = None):
-    """clean and join the county covid and masks NYT datasets for STOR155 project"""
-    county = covid_by_co(data = county)
+def _by_co_fresh(county):
+    # by_co_file holds the aggregate of county, and is at least as new
+    return (os.path.exists(by_co_file) and os.path.exists(by_co_source) and os.path.samefile(county, by_co_source)
+            and os.path.getmtime(by_co_file) >= os.path.getmtime(county))
+
+
+def project_data(county = None, masks = None, chunksize = 250000):
+    """clean and join the county covid and masks NYT datasets for STOR155 project.
+    county is either the raw data frame or a path to the csv, which is then streamed, see covid_by_co_stream.
+    for by_co_source, the aggregate at by_co_file is used instead when it is at least as new as the csv"""
+    if isinstance(county, str) and _by_co_fresh(county):
+        county = pd.read_pickle(by_co_file)
+    elif isinstance(county, str):
+        county = covid_by_co_stream(county, chunksize = chunksize)
+    else:
+        county = covid_by_co(data = county)
     masks = masks_by_co(data = masks)
     d = county.merge(masks, how = 'left', on = 'fips')
 
     return d
 
 
+@buildcache.memoize(files = ['county_file', 'masks_file'], ignore = ['chunksize'])
+def load_project_data(county_file = 'raw/covid_nyt.csv', masks_file = 'raw/maskuse_nyt.csv', chunksize = 250000):
+    """project_data from the raw csvs, cached on their content, see buildcache"""
+    return project_data(county = county_file, masks = pd.read_csv(masks_file), chunksize = chunksize)
+
+
 # TODO:
 # make this consistent with the fedapi script
-# make special class and check class type before processing
 # checks for all masks data missing for a given state (none missing in original survey)
 
 # THIS IS WHERE YOU SET THE FILE OUT PATH
 @process_dsamples(pathout = '../stor155_sp21/project/CV', filepre = 'CV')
-def sample_and_dump(data, n, **kwargs):
+def sample_and_dump(data, n, seed = None, strata = None, replace = True):
     """
     randomly sample states with replacement (default) from d created by project data, and for each state:
     subset d to state and write out csv with name specifying sampling id
     one sampling id per student, to assign one dataset to each student (w/ possible duplicates)
-    additional kwargs are passed to sample method
+    seed makes the draw reproducible and strata (by state, see sampling.Sampler) spreads students across them.
+    the assignment is recorded in a manifest next to the files, see sampling.Assignment.write.
+    formats, the list of output formats (see util.writers), is passed through to the writer.
 
     Does not consider states where there is no mask data
     """
 
-    if 'replace' not in kwargs.keys():
-        kwargs['replace'] = True
-
-
     # states must have at least 15 observations (counties)
     # remove states where there is no mask use data
-    s = pd.Series(data.state.unique()).sort_values().reset_index(drop = True)
+    # one pass: per state, any county with mask data and the number of counties
+    masks = data.loc[:, 'masks_never':'masks_always'].notna().any(axis = 1)
+    states = masks.groupby(data.state, sort = True).agg(['any', 'size'])
 
-    nonmiss = data.groupby('state').apply(lambda x: x.notna().sum()).loc[:, 'masks_never':'masks_always'].sum(axis = 1).ge(1)
-    nonmiss = nonmiss.sort_index().reset_index(drop = True)
+    eligible = states['any'] & states['size'].ge(15)
 
-    large = data.groupby('state').size().ge(15).sort_index().reset_index(drop = True)
-
-    s = s.loc[nonmiss & large]
-    s = s.sample(n, **kwargs)
-
-    data = [data.loc[data.state == v] for k, v in s.items()]
+    data = sampling.Sampler(data, by = 'state', eligible = eligible, strata = strata).assign(n, seed = seed, replace = replace)
 
     return data
 
@@ -204,14 +383,26 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser('Sample states and write out county-by-state level for STOR155 projects, spring `21. Data read from dataSTOR/raw')
     parser.add_argument('n', type = int, help = 'number of datasets, equal to number of students')
     parser.add_argument('--get', action = 'store_true', help = 'get the raw data first')
+    parser.add_argument('--full', action = 'store_true', help = 'with --get, re-download everything rather than only new rows')
+    parser.add_argument('--formats', nargs = '+', default = ['csv', 'xlsx'], help = 'output formats, any of csv xlsx parquet feather')
+    parser.add_argument('--rebuild', action = 'store_true', help = 'ignore cached cleaning results')
+    parser.add_argument('--seed', type = int, default = None, help = 'seed for the draw of states, recorded in the manifest either way')
+    parser.add_argument('--metrics', type = str, default = None, help = 'record stage metrics to this json lines file, see instrument')
 
     args = parser.parse_args()
 
+    if args.metrics is not None:
+        instrument.enabled = True
+        instrument.log_to(args.metrics)
+
     if args.get:
-        get_raw()
+        get_raw(incremental = not args.full)
+
+    if args.rebuild:
+        buildcache.invalidate('covid_nyt.load_project_data')
 
-    masks = pd.read_csv('raw/maskuse_nyt.csv')
-    county = pd.read_csv('raw/covid_nyt.csv')
+    d = load_project_data()
+    sample_and_dump(d, args.n, seed = args.seed, formats = args.formats)
 
-    d = project_data(county = county, masks = masks)
-    sample_and_dump(d, args.n)
+    if args.metrics is not None:
+        print(instrument.summary())
@@ -6,9 +6,20 @@ get data from the FRED API
 https://fred.stlouisfed.org/docs/api/fred/
 """
 
-import requests
+import os
+import json
+import time
+import random
+import threading
+import numpy as np
 import pandas as pd
-from functools import wraps
+import sampling
+import httpcache
+import instrument
+from functools import wraps, partial
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 
 # TODO:
 # place funs overlappling with other modules in common util for later packaging
@@ -23,6 +34,25 @@ from functools import wraps
 # else use as cli argument
 # key = ''
 
+# point this at a local stub server for testing
+base_url = 'https://api.stlouisfed.org/fred/'
+
+# FRED allows 120 requests per minute per key
+rate_limit = 120
+
+# default number of concurrent requests in get_and_dump
+workers = 8
+
+# optional on-disk response cache, e.g. cache = httpcache.ResponseCache('raw/fred_cache.sqlite')
+# set cache.offline = True to work only from what has been fetched before
+cache = None
+
+# where update_series keeps observations, one csv per series id
+store = 'raw/fred'
+
+# number of most recent stored observations update_series re-pulls to pick up FRED revisions
+revisions = 8
+
 #######
 # INTERNALS AND DECORATORS
 #######
@@ -32,33 +62,128 @@ def _series_ids():
     for use in get_series"""
 
 
+# one keep-alive connection pool shared by all getters and threads
+_session = None
+_pool_size = 0
+_session_lock = threading.Lock()
+
+def _get_session(pool_size = None):
+    """the shared session. pass the number of threads about to use it, and its pool is grown to keep one
+    connection per thread alive"""
+    # requests is imported on first use, not with the module
+    import requests.adapters
+    global _session, _pool_size
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        if _pool_size == 0 or (pool_size or 0) > _pool_size:
+            _pool_size = max(pool_size or 0, 10)
+            adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = _pool_size)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+    return _session
+
+
+# at most rate_limit requests in any 60 seconds, across threads. requests under that go out at once
+_sent = deque()
+_throttle_lock = threading.Lock()
+
+def _throttle():
+    with _throttle_lock:
+        now = time.monotonic()
+        while _sent and _sent[0] <= now - 60:
+            _sent.popleft()
+
+        while len(_sent) >= rate_limit:
+            time.sleep(max(_sent[0] + 60 - time.monotonic(), 0))
+            _sent.popleft()
+
+        _sent.append(time.monotonic())
+
+
+def _cached_response(body):
+    import requests.models
+    r = requests.models.Response()
+    r.status_code = 200
+    r._content = body
+    return r
+
+
+def _get(endpoint, params, last_updated = None, retries = 5, backoff = 1.0, **kwargs):
+    """GET base_url + endpoint through the shared session. retries with exponential backoff (plus jitter) on 429 and 5xx,
+    honoring Retry-After when FRED sends it. returns the last response either way, safe_get checks status.
+
+    with a cache set, a stored response is returned instead when it is fresh, see httpcache. pass the series
+    last_updated from the metadata to keep a response until its vintage moves."""
+    params = dict(params, file_type = 'json')
+
+    if cache is not None:
+        ckey = cache.key(endpoint, params)
+        body = cache.get(ckey, last_updated = last_updated)
+
+        if body is not None:
+            instrument.count(cache_hits = 1)
+            return _cached_response(body)
+
+        if cache.offline:
+            raise LookupError(f"offline and no cached response for {endpoint} {params}")
+
+    session = _get_session()
+
+    for attempt in range(retries + 1):
+        _throttle()
+        r = session.get(base_url + endpoint, params = params, **kwargs)
+        instrument.count(requests = 1, http_bytes = len(r.content))
+
+        if r.status_code != 429 and r.status_code < 500:
+            break
+
+        if attempt < retries:
+            instrument.count(retries = 1)
+            delay = r.headers.get('Retry-After')
+            delay = float(delay) if delay and delay.isdigit() else backoff * 2 ** attempt
+            time.sleep(delay + random.uniform(0, backoff))
+
+    if cache is not None and r.status_code == 200:
+        payload = json.loads(r.content)
+        cache.put(ckey, r.content, endpoint = endpoint, params = params, last_updated = last_updated,
+                  realtime_start = payload.get('realtime_start'), realtime_end = payload.get('realtime_end'))
+
+    return r
+
+
+# expects the raw observation records, see safe_get(frame = False)
 def clean_series(f):
     @wraps(f)
+    @instrument.stage(f, 'clean_series')
     def wrapper(*args, **kwargs):
-        d = f(*args, **kwargs)
-        d = d.drop(columns = ['realtime_start', 'realtime_end'])
+        obs = f(*args, **kwargs)
 
-        # the federal reserve in its wisdom is using a . for missing values
-        d.value = d.value.str.replace(r'^\.$', 'NaN').astype('float')
-        d.date = pd.to_datetime(d.date)
+        # parse straight from the records into arrays, skipping an intermediate object frame.
+        # dates are always yyyy-mm-dd, which numpy parses natively.
+        # the federal reserve in its wisdom is using a . for missing values, coerce makes those NaN
+        date = np.array([o['date'] for o in obs], dtype = 'datetime64[ns]')
+        value = pd.to_numeric(np.array([o['value'] for o in obs], dtype = object), errors = 'coerce')
 
         # give the 'value' column the series name
         # so students can ref docs on FRED, then change the name
         var = kwargs.get('ids')
-        d = d.rename(columns = {'value': var})
+        d = pd.DataFrame({'date': date, var: np.asarray(value, dtype = 'float64')})
 
         return d
     return wrapper
 
 
-# check for errors, return df
-def safe_get(target_key):
+# check for errors, return df, or the list of records with frame = False
+def safe_get(target_key, frame = True):
     def getter(f):
         @wraps(f)
+        @instrument.stage(f, 'safe_get')
         def wrapper(*args, **kwargs):
             r = f(*args, **kwargs)
             assert r.status_code == 200, f"Unsuccessful request, status code {r.status_code}"
-            return pd.DataFrame(r.json()[target_key])
+            records = r.json()[target_key]
+            return pd.DataFrame(records) if frame else records
         return wrapper
     return getter
 
@@ -75,124 +200,363 @@ def get_tags(key, **kwargs):
     https://fred.stlouisfed.org/docs/api/fred/tags.html
     """
 
-    url = f'https://api.stlouisfed.org/fred/tags?api_key={key}&file_type=json'
-
-    r = requests.get(url, **kwargs)
+    r = _get('tags', dict(api_key = key), **kwargs)
 
     return r
 
 
 
-@safe_get('seriess')
-def get_series_meta(key, tag_names,
-exclude_tag_names = None, limit = 1000, **kwargs):
-    """https://fred.stlouisfed.org/docs/api/fred/tags_series.html"""
-    url = 'https://api.stlouisfed.org/fred/tags/series?'
+# FRED caps tags/series pages at 1000 series
+page_limit = 1000
 
+def _tags_series(key, tag_names, exclude_tag_names = None, limit = page_limit, offset = 0, **kwargs):
+    # one page of tags/series, ordered by id so that pages don't overlap
     if type(tag_names) is list:
         tag_names = ';'.join(tag_names)
 
-    url = url + f'tag_names={tag_names}&'
+    params = dict(tag_names = tag_names, api_key = key, limit = limit, offset = offset, order_by = 'series_id')
 
     if exclude_tag_names is not None:
         if type(exclude_tag_names) is list:
             exclude_tag_names = ';'.join(exclude_tag_names)
 
-        url = url + f'exclude_tag_names={exclude_tag_names}&'
+        params['exclude_tag_names'] = exclude_tag_names
 
-    url = url + f'api_key={key}&file_type=json'
+    return _get('tags/series', params, **kwargs)
 
-    r = requests.get(url, **kwargs)
+
+@safe_get('seriess')
+def get_series_meta(key, tag_names,
+exclude_tag_names = None, limit = page_limit, offset = 0, **kwargs):
+    """https://fred.stlouisfed.org/docs/api/fred/tags_series.html
+
+    one page of at most limit series from offset, see discover_series for all of them"""
+
+    r = _tags_series(key, tag_names, exclude_tag_names = exclude_tag_names, limit = limit, offset = offset, **kwargs)
 
     return r
 
 
+def discover_series(key, tag_sets, exclude_tag_names = None, workers = workers, limit = page_limit, **kwargs):
+    """every series matching any of tag_sets, each the tags a series must all have, as a list or a ';' separated
+    string (a single string is one set). one row per series id, tag_names being the first set it matched.
+
+    the first page of every set is requested at once on a pool of workers threads, then all remaining
+    pages together, so the time taken is set by rate_limit rather than by the number of round trips."""
+
+    if isinstance(tag_sets, str):
+        tag_sets = [tag_sets]
+
+    tag_sets = [t if isinstance(t, str) else ';'.join(t) for t in tag_sets]
+
+    def page(tags, offset):
+        r = _tags_series(key, tags, exclude_tag_names = exclude_tag_names, limit = limit, offset = offset, **kwargs)
+        assert r.status_code == 200, f"Unsuccessful request, status code {r.status_code}"
+        return r.json()
+
+    _get_session(workers)
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        first = [pool.submit(page, t, 0) for t in tag_sets]
+        first = [f.result() for f in first]
+
+        rest = [[pool.submit(page, t, offset) for offset in range(limit, p['count'], limit)] for t, p in zip(tag_sets, first)]
+        pages = [[p] + [f.result() for f in fs] for p, fs in zip(first, rest)]
+
+    d = [pd.DataFrame(p['seriess']).assign(tag_names = t) for t, ps in zip(tag_sets, pages) for p in ps if p['seriess']]
+
+    if not d:
+        return pd.DataFrame(columns = ['id', 'tag_names'])
+
+    return pd.concat(d, ignore_index = True).drop_duplicates('id').reset_index(drop = True)
+
+
 
 # GET DATA SERIES
 
 @clean_series
-@safe_get('observations')
-def get_series(key, ids = None, **kwargs):
-    """https://fred.stlouisfed.org/docs/api/fred/series_observations.html"""
+@safe_get('observations', frame = False)
+def get_series(key, ids = None, last_updated = None, observation_start = None, **kwargs):
+    """https://fred.stlouisfed.org/docs/api/fred/series_observations.html
+
+    last_updated is the series last_updated from get_series_meta. with a cache set, the stored
+    observations are reused for as long as it matches.
+    observation_start (yyyy-mm-dd) limits the request to observations on or after that date."""
 
-    url = f'https://api.stlouisfed.org/fred/series/observations?series_id={ids}&api_key={key}&file_type=json'
+    params = dict(series_id = ids, api_key = key)
 
-    r = requests.get(url, **kwargs)
+    if observation_start is not None:
+        params['observation_start'] = observation_start
+
+    r = _get('series/observations', params, last_updated = last_updated, **kwargs)
 
     return r
 
 
+def update_series(key, ids = None, last_updated = None, store = store, revisions = revisions, **kwargs):
+    """get_series, but incremental against a local copy at store/ids.csv.
+
+    only observations from the last revisions stored dates onwards are requested, so that
+    FRED revisions to recent values are picked up, and they replace the stored tail. with revisions 0
+    only observations after the last stored date are.
+    the first call for a series pulls the full history. returns the updated series."""
+    if revisions < 0:
+        raise ValueError(f"revisions must be 0 or more, not {revisions}")
+
+    path = f'{store}/{ids}.csv'
+
+    if not os.path.exists(path):
+        d = get_series(key, ids = ids, last_updated = last_updated, **kwargs)
+
+    else:
+        old = pd.read_csv(path, parse_dates = ['date'])
+        if old.shape[0] == 0:
+            start = None
+        elif revisions == 0:
+            # FRED dates are days, so the day after the last stored one starts the next period
+            start = old.date.iloc[-1] + pd.Timedelta(days = 1)
+        else:
+            start = old.date.iloc[max(old.shape[0] - revisions, 0)]
+
+        if start is None:
+            new = get_series(key, ids = ids, last_updated = last_updated, **kwargs)
+        else:
+            new = get_series(key, ids = ids, last_updated = last_updated, observation_start = start.strftime('%Y-%m-%d'), **kwargs)
+            old = old.loc[old.date < start]
+
+        d = pd.concat([old, new], ignore_index = True)
+
+    os.makedirs(store, exist_ok = True)
+    d.to_csv(path, index = False)
+
+    return d
+
+
+
+#######
+# SERIES INDEX
+#######
+
+# series ids by (indicator, country, frequency, seasonal adjustment, gender), so assembling a panel is a lookup.
+# each indicator is discovered with its tags and its series titles are parsed once, with title, for country and
+# gender. the index is kept at index_file and update only parses series that are new or have a new last_updated.
+# frequency and seasonal adjustment are FRED's short codes, lowercased, e.g. q and nsa. no gender is ''.
+# series whose titles don't match or that are discontinued stay in the index with country '', so they aren't parsed
+# again either, and of series sharing a key the most recently updated is the one looked up
+
+index_file = 'raw/fred_index.csv'
+
+indicators = dict(
+    empl = dict(tags = 'employment-population ratio;quarterly;nsa',
+                title = r'^employment to population rate: all ages: (?P<gender>females|males) for (?:the )?(?P<country>[a-z\s]+)$'),
+    gdp = dict(tags = 'gdp;quarterly;nsa',
+               title = r'^gross domestic product(?!.*euro/ecu series).*\bfor\s*(?:the)?\s*(?P<country>[a-z\s]+)$'))
+
+index_keys = ['indicator', 'country', 'frequency', 'seasonal_adjustment', 'gender']
+index_columns = ['id'] + index_keys + ['title', 'last_updated']
+
+
+class SeriesIndex:
+    """the series index at path, see SERIES INDEX above. empty if the file does not exist yet"""
+
+    def __init__(self, path = index_file, indicators = indicators):
+        self.path = path
+        self.indicators = indicators
+
+        if os.path.exists(path):
+            self.data = pd.read_csv(path, dtype = str, keep_default_na = False)
+        else:
+            self.data = pd.DataFrame(columns = index_columns, dtype = str)
+
+        self._lookup()
+
+    def _lookup(self):
+        d = self.data.loc[self.data.country != ''].sort_values('last_updated', kind = 'stable')
+        keys = zip(*[d[k] for k in index_keys])
+        self._ids = dict(zip(keys, d.id))
+
+    def update(self, meta):
+        """fold discover_series output for the indicators' tags into the index. returns the number of series parsed.
+        series of an indicator that discovery no longer returns are dropped"""
+        if meta.empty:
+            return 0
+
+        by_tags = {v['tags']: k for k, v in self.indicators.items()}
+        meta = meta.loc[meta.tag_names.isin(by_tags)].assign(indicator = lambda x: x.tag_names.map(by_tags))
+
+        known = dict(zip(self.data.id, self.data.last_updated))
+        fresh = meta.loc[[known.get(i) != u for i, u in zip(meta.id, meta.last_updated)]]
+
+        parsed = []
+        for k, rows in fresh.groupby('indicator'):
+            title = rows.title.str.lower()
+            m = title.str.extract(self.indicators[k]['title'])
+            ok = m.country.notna() & ~title.str.contains('discontinued', regex = False)
+
+            parsed.append(pd.DataFrame(dict(id = rows.id, indicator = k, country = m.country.str.strip().where(ok, ''),
+                                            frequency = rows.frequency_short.str.lower(),
+                                            seasonal_adjustment = rows.seasonal_adjustment_short.str.lower(),
+                                            gender = m.get('gender', pd.Series('', index = m.index)).fillna(''),
+                                            title = rows.title, last_updated = rows.last_updated)))
+
+        keep = self.data.id.isin(meta.id) | ~self.data.indicator.isin(meta.indicator)
+        d = pd.concat([self.data.loc[keep & ~self.data.id.isin(fresh.id)]] + parsed, ignore_index = True)
+
+        self.data = d.sort_values(index_keys + ['last_updated']).reset_index(drop = True)
+        self._lookup()
+
+        return fresh.shape[0]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+        self.data.loc[:, index_columns].to_csv(self.path, index = False)
+
+    def get(self, indicator, country, frequency = 'q', seasonal_adjustment = 'nsa', gender = ''):
+        """series id, or None"""
+        return self._ids.get((indicator, country, frequency, seasonal_adjustment, gender))
+
+    def panel(self, columns, countries = None, frequency = 'q', seasonal_adjustment = 'nsa'):
+        """series ids, one row per country that has all of columns, {name: (indicator, gender)}.
+        countries defaults to every country in the index"""
+        if countries is None:
+            countries = sorted(set(self.data.country) - {''})
+
+        rows = {c: [self.get(i, c, frequency, seasonal_adjustment, g) for i, g in columns.values()] for c in countries}
+        rows = {c: v for c, v in rows.items() if None not in v}
+
+        return pd.DataFrame.from_dict(rows, orient = 'index', columns = list(columns)).rename_axis('country')
+
+
+
+#######
+# PANELS
+#######
+
+# lower frequencies each FRED frequency can be aggregated to, with the number of observations in a full period
+aggregations = dict(m = dict(q = 3, a = 12), q = dict(a = 4))
+
+# pandas period start for each FRED frequency
+period_starts = dict(m = 'MS', q = 'QS', a = 'YS')
+
+
+def to_frequency(d, source, target, how = 'mean'):
+    """get_series frame d at frequency source (a FRED short code, lowercase) aggregated to target, e.g. q to a.
+    how is mean, sum or last, as FRED's avg, sum and eop. periods missing any observation are dropped"""
+    if source == target:
+        return d
+    if target not in aggregations.get(source, {}):
+        raise ValueError(f"can't convert {source} to {target}, only to one of {list(aggregations.get(source, {}))}")
+
+    g = d.set_index('date').resample(period_starts[target])
+    full = g.count().eq(aggregations[source][target]).all(axis = 1)
+
+    return g.agg(how).loc[full].reset_index()
+
+
+def join_series(frames):
+    """get_series frames joined on their dates in one pass, only dates in all of them. date then one column per series"""
+    return pd.concat([d.set_index('date') for d in frames], axis = 1, join = 'inner').reset_index()
+
+
+class Panels(Mapping):
+    """one panel per country, built on first access: the series in ids.loc[country] fetched, converted
+    to frequency and joined, see join_series.
+
+    ids: series ids, one row per country (e.g. SeriesIndex.panel)
+    fetch: series id -> get_series frame, e.g. partial(get_series, key)
+    frequencies: series id -> FRED frequency short code, needed for frequency"""
+
+    def __init__(self, ids, fetch, frequency = None, frequencies = None, how = 'mean', workers = workers):
+        self.ids, self.fetch, self.workers = ids, fetch, workers
+        self.frequency, self.frequencies, self.how = frequency, frequencies or {}, how
+        self._series, self._panels = {}, {}
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def __iter__(self):
+        return iter(self.ids.index)
+
+    def prefetch(self, countries):
+        """fetch the series of countries not fetched yet, all at once on a pool of workers threads"""
+        todo = [v for v in pd.unique(self.ids.loc[list(countries)].values.ravel()) if v not in self._series]
+
+        _get_session(self.workers)
+        with ThreadPoolExecutor(max_workers = self.workers) as pool:
+            self._series.update(zip(todo, pool.map(self.fetch, todo)))
+
+    def _get_series(self, v):
+        if v not in self._series:
+            self._series[v] = self.fetch(v)
+
+        d = self._series[v]
+        if self.frequency is not None:
+            d = to_frequency(d, self.frequencies.get(v, self.frequency), self.frequency, how = self.how)
+
+        return d
+
+    def __getitem__(self, country):
+        if country not in self._panels:
+            self._panels[country] = join_series([self._get_series(v) for v in self.ids.loc[country]])
+
+        return self._panels[country]
+
+
 
 
 ###########
 # WRITE OUT PROJECT DATA
 #########
 # TODO:
-# break out the country selection part, handle for all in tag_names argument
-# too much heterogeneity to functionalize country name handling?
-# add annual data series get
 # create a process_dsamples decorator as in covid_nyt, or make that one more all-purpose
 
 
-def get_and_dump(key, n, path):
+def get_and_dump(key, n, path, workers = workers, store = None, write_workers = None, formats = ('csv', 'xlsx'), seed = None, discover = True, frequency = 'q'):
     """write out n data files for STOR155 project, sampled from a collection
     of employment and economic time series by gender for different european countries.
 
-    Note that matching across series relies on the fact that country names are at the end of the series titles.
+    Note that matching across series relies on the fact that country names are at the end of the series titles,
+    see SeriesIndex. without discover, the stored index is used as is rather than refreshed from FRED.
 
     the collection sampled from could be at quarterly or annual time intervals, consistent within each file.
+    frequency 'a' averages the quarterly series over full years, see to_frequency.
 
     file format is FRED_i.{csv,xlsx} for i = 0 ... n-1 where each i corresponds to an single student.
+    formats picks other output formats, any of the keys in util.writers.
+
+    requests run on a pool of workers threads sharing one session, so wall time scales with
+    series count / workers rather than series count. only the series of countries drawn are fetched, see Panels.
+
+    with store set, series are refreshed incrementally against local copies there, see update_series.
+
+    files are written by write_workers processes (default one per core), see util.write_samples.
+
+    countries are drawn with seed, see sampling.Sampler, and the draw is recorded in path/FRED_manifest.csv.
 
     source: Federal Reserve FRED database
     """
-    
-    # get quarterly emp-pop ratio
-    empl = get_series_meta(key, tag_names = ['employment-population ratio', 'quarterly', 'nsa'])
 
-    matches = ~empl.title.str.contains('DISCONTINUED') & empl.title.str.match('Employment to Population Rate: All Ages: (Females|Males)')
-    mycountry = empl.loc[matches].title.str.extract(r':\s+([A-z\s]+)$', expand = False).str.split(pat = r'\sfor\s(the\s)?', expand = True)
-    mycountry = mycountry.iloc[:, [0, 2]].rename(columns = {0: 'gender', 2: 'country'})
+    # series ids for countries with gdp and employment by gender, from the series index.
+    # discovery refreshes it first, every page of both indicators at once
+    index = SeriesIndex(index_file)
+
+    if discover or index.data.empty:
+        index.update(discover_series(key, [v['tags'] for v in indicators.values()], workers = workers))
+        index.save()
+
+    ids = index.panel(dict(gdp = ('gdp', ''), Females = ('empl', 'females'), Males = ('empl', 'males')))
+
+    # panels are only built for the countries drawn, and their series fetched all at once
+    meta = index.data.set_index('id')
+    fetch = get_series if store is None else partial(update_series, store = store)
+    fetch = lambda v, fetch = fetch: fetch(key, ids = v, last_updated = meta.last_updated.get(v))
+
+    panels = Panels(ids, fetch, frequency = frequency, frequencies = meta.frequency.to_dict(), workers = workers)
+    assigned = sampling.Sampler(panels).assign(n, seed = seed)
+    panels.prefetch(pd.unique(assigned.manifest.group))
+
+    assigned.write(path, 'FRED', formats = formats, workers = write_workers)
 
-    # df with series info, including ID for API
-    empl = mycountry.merge(empl.loc[:, ['id']], left_index = True, right_index = True).reset_index(drop = True)
-    empl.country = empl.country.str.lower()
-    
-    
-    # get gdp data series info for those same countries
-    gdp = get_series_meta(key, tag_names = ['gdp', 'quarterly', 'nsa'])
 
-    gdp.title = gdp.title.str.lower()
-    matches = ~gdp.title.str.contains('euro/ecu series') & gdp.title.str.match('gross domestic product')
-    
-    gdp = gdp.loc[matches].assign(title = lambda x: x.title.str.extract(r'for\s*(the)?\s*([A-z\s]+)$', expand = False).loc[:, 1])
-    gdp = gdp.loc[gdp.title.isin(empl.country)].loc[:, ['title', 'id']].rename(columns = {'title': 'country', 'id': 'gdp'})
-    
-    # join empl and gdp
-    # drop level none to avoid warning
-    series = empl.pivot(index = 'country', columns = 'gender').droplevel(level = None, axis = 1).merge(gdp, how = 'inner', right_on = 'country', left_index = True)
-      
-    # get all, assign to student numbers later since likely n > out.shape[0]
-    def series_by_country(i, series):
-        # merging on date should be safe --- fred seems to format consistently 
-        d = [get_series(key, ids = v) for v in series.loc[i, ['gdp', 'Females', 'Males']]]
-        d = d[0].merge(d[1].merge(d[2], how = 'inner', on = 'date'), how = 'inner', on = 'date')
-    
-        return d
-    
-    out = [series_by_country(i, series) for i in series.index]
-    
-    s = pd.Series(range(len(out))).sample(n, replace = True)
-    
-    for i, v in enumerate(s):
-        try:
-            out[v].to_csv(path + f'/FRED_{i}.csv', index = False)
-            out[v].to_excel(path + f'/FRED_{i}.xlsx', index = False)
-        except:
-            continue
-            
-
-            
 #######
 # RUN
 #######
@@ -205,7 +569,27 @@ if __name__ == "__main__":
     parser.add_argument('key', type = str, help = 'your FRED api key')
     parser.add_argument('n', type = int, help = 'number of datasets, equal to number of students')
     parser.add_argument('path_out', type = str, help = 'filepath to store output, as path_out/FRED_{i}.{csv,xlsx} for i = 0...n-1')
+    parser.add_argument('--workers', type = int, default = workers, help = 'number of concurrent requests to FRED')
+    parser.add_argument('--cache', type = str, default = None, help = 'sqlite file to cache responses in, e.g. raw/fred_cache.sqlite')
+    parser.add_argument('--offline', action = 'store_true', help = 'serve only from --cache, make no requests')
+    parser.add_argument('--store', type = str, default = None, help = f'refresh series incrementally against csv copies kept here, e.g. {store}')
+    parser.add_argument('--write-workers', type = int, default = None, help = 'number of processes writing files, default one per core')
+    parser.add_argument('--formats', nargs = '+', default = ['csv', 'xlsx'], help = 'output formats, any of csv xlsx parquet feather')
+    parser.add_argument('--seed', type = int, default = None, help = 'seed for the draw of countries, recorded in the manifest either way')
+    parser.add_argument('--frequency', choices = ['q', 'a'], default = 'q', help = 'quarterly, or annual averages of the quarterly series')
+    parser.add_argument('--metrics', type = str, default = None, help = 'record stage metrics to this json lines file, see instrument')
+    parser.add_argument('--use-index', action = 'store_true', help = f'take series ids from {index_file} without rediscovering them')
 
     args = parser.parse_args()
 
-    get_and_dump(args.key, args.n, args.path_out)
+    if args.metrics is not None:
+        instrument.enabled = True
+        instrument.log_to(args.metrics)
+
+    if args.cache is not None:
+        cache = httpcache.ResponseCache(args.cache, offline = args.offline)
+
+    get_and_dump(args.key, args.n, args.path_out, workers = args.workers, store = args.store, write_workers = args.write_workers, formats = args.formats, seed = args.seed, discover = not args.use_index, frequency = args.frequency)
+
+    if args.metrics is not None:
+        print(instrument.summary())
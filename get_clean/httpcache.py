@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+on-disk cache for http responses, stored in a single sqlite file
+
+entries are keyed on endpoint plus request parameters and hold the zlib-compressed response body with
+whatever vintage information the caller has: FRED realtime_start/realtime_end and series last_updated,
+or ETag/Last-Modified validators for plain file downloads.
+
+freshness rules
+    * an entry stored with last_updated is valid for as long as the caller passes the same last_updated,
+      regardless of age. a different last_updated means the vintage moved and the entry is stale.
+    * any other entry is valid for ttl seconds (None means forever).
+    * in offline mode every stored entry is served, and misses are the caller's problem.
+
+the file is kept under max_bytes (compressed) by dropping least recently used entries.
+"""
+
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT,
+    params TEXT,
+    body BLOB,
+    size INTEGER,
+    fetched_at REAL,
+    accessed_at REAL,
+    realtime_start TEXT,
+    realtime_end TEXT,
+    last_updated TEXT,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+_meta = ['realtime_start', 'realtime_end', 'last_updated', 'etag', 'last_modified']
+
+
+class ResponseCache:
+    """sqlite-backed response store. safe to share across threads.
+
+    path: sqlite file, created if missing
+    ttl: seconds before an entry without last_updated goes stale, None for never
+    max_bytes: cap on total compressed body size
+    offline: serve only from the cache, never go to the network
+    """
+
+    def __init__(self, path, ttl = 24 * 3600, max_bytes = 512 * 2**20, offline = False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread = False)
+        self._con.executescript(_schema)
+
+    @staticmethod
+    def key(endpoint, params = None):
+        """stable key for endpoint plus params. api keys are left out so caches can be shared"""
+        params = {k: str(v) for k, v in (params or {}).items() if k != 'api_key'}
+        raw = json.dumps([endpoint, sorted(params.items())])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key, last_updated = None):
+        """body as bytes if there is a usable entry for key, else None. see module description for the rules."""
+        with self._lock:
+            row = self._con.execute('SELECT body, fetched_at, last_updated FROM responses WHERE key = ?', (key,)).fetchone()
+
+            if row is None:
+                return None
+
+            body, fetched_at, stored_updated = row
+
+            if not self.offline:
+                if last_updated is not None or stored_updated is not None:
+                    if stored_updated != last_updated:
+                        return None
+                elif self.ttl is not None and time.time() - fetched_at > self.ttl:
+                    return None
+
+            self._con.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+            self._con.commit()
+
+        return zlib.decompress(body)
+
+    def meta(self, key):
+        """stored vintage info for key as a dict, or None. ignores freshness."""
+        with self._lock:
+            row = self._con.execute(f'SELECT {", ".join(_meta)} FROM responses WHERE key = ?', (key,)).fetchone()
+
+        return None if row is None else dict(zip(_meta, row))
+
+    def put(self, key, body, endpoint = None, params = None, **meta):
+        """store body (bytes) under key. meta takes any of realtime_start, realtime_end, last_updated, etag, last_modified"""
+        unknown = set(meta) - set(_meta)
+        assert not unknown, f"unknown cache metadata {unknown}"
+
+        body = zlib.compress(body)
+        now = time.time()
+        params = json.dumps({k: str(v) for k, v in (params or {}).items() if k != 'api_key'}, sort_keys = True)
+        row = [key, endpoint, params, body, len(body), now, now] + [meta.get(m) for m in _meta]
+
+        with self._lock:
+            self._con.execute(f'INSERT OR REPLACE INTO responses VALUES ({", ".join(["?"] * len(row))})', row)
+            self._con.commit()
+
+        self.evict()
+
+    def evict(self):
+        """drop expired ttl entries, then least recently used entries until under max_bytes"""
+        with self._lock:
+            if self.ttl is not None and not self.offline:
+                self._con.execute('DELETE FROM responses WHERE last_updated IS NULL AND etag IS NULL AND last_modified IS NULL AND fetched_at < ?',
+                                  (time.time() - self.ttl,))
+
+            total = self._con.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                drop = []
+
+                for key, size in self._con.execute('SELECT key, size FROM responses ORDER BY accessed_at'):
+                    if excess <= 0:
+                        break
+                    drop.append((key,))
+                    excess -= size
+
+                self._con.executemany('DELETE FROM responses WHERE key = ?', drop)
+
+            self._con.commit()
+
+    def clear(self):
+        with self._lock:
+            self._con.execute('DELETE FROM responses')
+            self._con.commit()
+
+    def close(self):
+        self._con.close()
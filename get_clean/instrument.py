@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+stage-level metrics for the decorators the get_clean modules route their work through
+
+a function wrapped with stage(f, label) is a stage named module.function:label, e.g. fredapi.get_series:safe_get.
+while enabled, every call records
+    seconds        wall time
+    rows_in        rows of the first data frame argument
+    rows_out       rows of the result (a data frame, or a list/tuple/dict of them)
+    bytes_out      memory of the result's columns, not counting object contents (deep = False, so cheap)
+    requests, http_bytes, retries, cache_hits
+                   counted by the code under the stage with count(), e.g. fredapi._get
+and hands the record to every sink in sinks. the default sink adds it to metrics, the in-process registry
+that summary() reports. log_to(file) adds a json lines log.
+
+profile (True, or a set of stage names) also runs matching stages under cProfile, accumulated in profiles.
+
+disabled (the default) a stage costs one global lookup per call and count() returns straight away.
+stages run in worker processes (e.g. canopy county histograms) record into those processes, not this one.
+
+    instrument.enabled = True
+    instrument.log_to('raw/metrics.jsonl')
+    ...
+    print(instrument.summary())
+"""
+
+import json
+import time
+import cProfile
+import pstats
+import threading
+import pandas as pd
+from functools import wraps
+
+
+enabled = False
+profile = False
+
+# per stage totals, see summary
+metrics = {}
+profiles = {}
+
+counters = ['requests', 'http_bytes', 'retries', 'cache_hits']
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _frame_rows(x):
+    if isinstance(x, (pd.DataFrame, pd.Series)):
+        return x.shape[0]
+    if isinstance(x, (list, tuple)) and x and all(isinstance(d, pd.DataFrame) for d in x):
+        return sum(d.shape[0] for d in x)
+    if isinstance(x, dict) and x and all(isinstance(d, pd.DataFrame) for d in x.values()):
+        return sum(d.shape[0] for d in x.values())
+    return None
+
+
+def _frame_bytes(x):
+    if isinstance(x, pd.DataFrame):
+        return int(x.memory_usage(index = True, deep = False).sum())
+    if isinstance(x, pd.Series):
+        return int(x.memory_usage(index = True, deep = False))
+    if isinstance(x, (list, tuple)) and _frame_rows(x) is not None:
+        return sum(_frame_bytes(d) for d in x)
+    if isinstance(x, dict) and _frame_rows(x) is not None:
+        return sum(_frame_bytes(d) for d in x.values())
+    return None
+
+
+def _rows_in(args, kwargs):
+    for a in list(args) + list(kwargs.values()):
+        if isinstance(a, pd.DataFrame):
+            return a.shape[0]
+    return None
+
+
+def count(**amounts):
+    """add amounts (any of counters) to the innermost stage running on this thread, if any"""
+    if not enabled:
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        for k, v in amounts.items():
+            stack[-1][k] += v
+
+
+def _registry(record):
+    with _lock:
+        m = metrics.setdefault(record['stage'], dict(calls = 0, errors = 0, seconds = 0.0, rows_in = 0, rows_out = 0,
+                                                    bytes_out = 0, **dict.fromkeys(counters, 0)))
+        m['calls'] += 1
+        m['errors'] += record['error'] is not None
+        for k in ['seconds', 'rows_in', 'rows_out', 'bytes_out'] + counters:
+            m[k] += record[k] or 0
+
+
+sinks = [_registry]
+
+
+def log_to(file):
+    """add a sink appending each record to file as a line of json"""
+    def sink(record):
+        with _lock, open(file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    sinks.append(sink)
+    return sink
+
+
+def _profiled(name):
+    return profile is True or (profile and name in profile)
+
+
+def stage(f, label):
+    """decorator making the wrapper a decorator puts around f a stage, see module description"""
+    name = f'{f.__module__}.{f.__name__}:{label}'
+
+    def decorator(wrapper):
+        @wraps(wrapper)
+        def instrumented(*args, **kwargs):
+            if not enabled:
+                return wrapper(*args, **kwargs)
+
+            stack = _local.__dict__.setdefault('stack', [])
+            own = dict.fromkeys(counters, 0)
+            stack.append(own)
+
+            prof = None
+            if _profiled(name):
+                prof = cProfile.Profile()
+                try:
+                    prof.enable()
+                except ValueError:
+                    # another profiler is active, e.g. a stage on another thread under python 3.12+
+                    prof = None
+
+            out, error = None, None
+            t = time.perf_counter()
+            try:
+                out = wrapper(*args, **kwargs)
+                return out
+            except BaseException as e:
+                error = type(e).__name__
+                raise
+            finally:
+                seconds = time.perf_counter() - t
+                if prof is not None:
+                    prof.disable()
+                    with _lock:
+                        profiles[name] = pstats.Stats(prof) if name not in profiles else profiles[name].add(prof)
+
+                stack.pop()
+                # nested stages count towards the stage around them too
+                if stack:
+                    for k in counters:
+                        stack[-1][k] += own[k]
+
+                record = dict(stage = name, time = time.time(), seconds = seconds, rows_in = _rows_in(args, kwargs),
+                              rows_out = _frame_rows(out), bytes_out = _frame_bytes(out), error = error, **own)
+                for sink in sinks:
+                    sink(record)
+
+        return instrumented
+
+    return decorator
+
+
+def summary():
+    """metrics as a data frame, one row per stage"""
+    return pd.DataFrame.from_dict(metrics, orient = 'index').rename_axis('stage')
+
+
+def reset():
+    metrics.clear()
+    profiles.clear()
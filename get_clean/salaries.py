@@ -16,39 +16,302 @@ export_date = "2021-04-29"
 
 raw_file = "raw/uncch_salaries.xlsx"
 
+# explicit types for the raw export columns, everything else is text
+raw_dtypes = {"AGE": "int64", "EMPLOYEE ANNUAL BASE SALARY": "float64"}
 
+
+import os
+import re
+import numpy as np
 import pandas as pd
+import util
+import buildcache
 
 ### GETTERS
 
-def get_salaries(file):
+# workbook readers, each returning the first sheet as an untyped data frame
+
+def _read_openpyxl(file):
     # xlrd no longer supports xlsx?
     return pd.read_excel(file, engine = 'openpyxl')
 
 
+def _read_stream(file):
+    # openpyxl in read_only mode streams rows rather than building the whole sheet in memory
+    import openpyxl
+
+    wb = openpyxl.load_workbook(file, read_only = True, data_only = True)
+    try:
+        rows = wb.active.iter_rows(values_only = True)
+        return pd.DataFrame.from_records(rows, columns = next(rows))
+    finally:
+        wb.close()
+
+
+def _read_calamine(file):
+    # rust xlsx parser, an order of magnitude faster (pip install python-calamine).
+    # it trims surrounding whitespace in text cells, which the openpyxl readers keep, so it is opt-in
+    from python_calamine import CalamineWorkbook
+
+    rows = CalamineWorkbook.from_path(file).get_sheet_by_index(0).to_python()
+    return pd.DataFrame.from_records(rows[1:], columns = rows[0])
+
+
+readers = dict(calamine = _read_calamine, stream = _read_stream, openpyxl = _read_openpyxl)
+
+
+def cache_file(file, engine = None):
+    """columnar copy of the workbook at file, as read by engine, that get_salaries reads when it is current.
+    one per engine, since they don't all read text cells the same way"""
+    return f"{os.path.splitext(file)[0]}.{engine or 'stream'}.parquet"
+
+
+def get_salaries(file, engine = None, cache = True):
+    """raw salaries workbook as a data frame with raw_dtypes applied, blank cells as missing.
+
+    engine is one of readers, by default streaming openpyxl.
+    with cache, the result is written once to cache_file(file, engine) (needs pyarrow) and read from there
+    for as long as it is newer than the workbook."""
+
+    cached = cache_file(file, engine)
+
+    if cache and os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(file):
+        return pd.read_parquet(cached)
+
+    d = readers[engine or "stream"](file)
+
+    # calamine hands back numbers as text
+    d = d.astype({k: v for k, v in raw_dtypes.items() if k in d.columns})
+
+    if cache:
+        try:
+            d.to_parquet(cached, index = False)
+        except ImportError:
+            pass
+
+    return d
+
+
 ### DATA PROCESS
 
 # no need to decorate here
 
+# as exported, e.g. FEB 01, 2014
+hire_date_format = "%b %d, %Y"
+
+# text columns with fewer distinct values than this share of rows become categories
+category_share = 0.5
+
+
+def _lower(s):
+    """lowercase a text column. low-cardinality columns become categories and only the categories are lowercased"""
+    if s.nunique() >= category_share * s.shape[0]:
+        return s.str.lower()
+
+    s = s.astype("category")
+
+    # lowercasing can merge categories, so recode rather than rename
+    codes, cats = pd.factorize(s.cat.categories.str.lower(), sort = True)
+    old = s.cat.codes.to_numpy()
+
+    return pd.Series(pd.Categorical.from_codes(np.where(old < 0, -1, codes[old]), cats), index = s.index, name = s.name)
+
+
+def _hire_date(s):
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    try:
+        return pd.to_datetime(s, format = hire_date_format)
+    except ValueError:
+        # some other export format
+        return pd.to_datetime(s)
+
+
 def standardize(d):
     """Standardizes formatting of raw excel salaries file. Column names made proper, all strings to lower, 
-    dates to datetime and a year column added for student convenience."""
+    dates to datetime and a year column added for student convenience.
+    Low-cardinality text columns come back as categories and integer columns downcast, values are unchanged."""
     
-    d.columns = d.columns.str.lower().str.replace("\s+", "_").str.replace('employee_', '')
-    d.loc[:, d.dtypes.eq('object')] = d.loc[:, d.dtypes.eq('object')].apply(lambda x: x.str.lower())
-    d = d.assign(initial_hire_date = pd.to_datetime(d.initial_hire_date), 
-                 hire_year = lambda x: x.initial_hire_date.dt.year)
+    d = d.rename(columns = lambda c: re.sub(r"\s+", "_", c.lower()).replace("employee_", ""))
+
+    date = _hire_date(d.initial_hire_date)
+    text = d.columns[d.dtypes.eq("object") & (d.columns != "initial_hire_date")]
+    ints = d.columns[[pd.api.types.is_integer_dtype(t) for t in d.dtypes]]
+
+    d = d.assign(**{c: _lower(d[c]) for c in text},
+                 **{c: pd.to_numeric(d[c], downcast = "integer") for c in ints},
+                 initial_hire_date = date,
+                 hire_year = pd.to_numeric(date.dt.year, downcast = "integer"))
     
     return d
 
 
+@buildcache.memoize(files = ['file'])
+def load_salaries(file):
+    """standardize(get_salaries(file)), cached on the content of file, see buildcache"""
+    return standardize(get_salaries(file))
+
+
+### HISTORY
+
+# quarterly snapshots kept as changes only. there is no employee id in the export, so an employee is
+# identified by name and hire date (plus a counter for the rare exact repeats), and a snapshot stores
+# only the rows whose values changed since the previous one, new employees, and the last row of
+# employees who left (flagged removed). every snapshot is one parquet file of those rows under the
+# store directory, so storage and load time grow with the number of changes.
+
+history_dir = "raw/salaries_history"
+
+identity = ["last_name", "first_name", "init", "initial_hire_date"]
+
+
+def _keys(d):
+    """one uint64 per row identifying the employee"""
+    n = d.groupby(identity, sort = False, observed = True, dropna = False).cumcount()
+    return pd.util.hash_pandas_object(d[identity].assign(n = n), index = False).to_numpy()
+
+
+def _row_hashes(d, columns):
+    """one uint64 per row of the values in columns, the same for categories and text and for any integer width"""
+    d = d.reindex(columns = columns)
+    ints = d.columns[[pd.api.types.is_integer_dtype(t) for t in d.dtypes]]
+    return pd.util.hash_pandas_object(d.astype({c: "int64" for c in ints}), index = False).to_numpy()
+
+
+class History:
+    """salaries snapshots in the store at path, see the HISTORY notes above.
+
+    add appends a snapshot, snapshot rebuilds one, diff compares two per employee and
+    trajectory follows group statistics across all of them."""
+
+    def __init__(self, path = history_dir):
+        self.path = path
+        self._versions = None
+
+    def dates(self):
+        """export dates in the store, oldest first"""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.splitext(f)[0] for f in os.listdir(self.path) if f.endswith(".parquet"))
+
+    # WRITE
+
+    def add(self, d, export_date):
+        """store standardize output d as the snapshot exported on export_date (yyyy-mm-dd).
+        export_date must be after every stored snapshot, or equal to the latest to replace it.
+        returns the number of changed rows stored"""
+
+        dates = self.dates()
+        if dates and export_date < dates[-1]:
+            raise ValueError(f"snapshot {export_date} is older than the latest stored, {dates[-1]}")
+
+        prior = [t for t in dates if t < export_date]
+        old = self.snapshot(prior[-1]) if prior else d.iloc[:0]
+
+        columns = [c for c in d.columns if c not in ("key", "export_date", "removed")]
+        new = d.assign(key = _keys(d), row_hash = _row_hashes(d, columns))
+        old = old.assign(key = old.get("key", new.key.iloc[:0]), row_hash = _row_hashes(old, columns))
+
+        same = new.key.isin(old.key) & new.row_hash.isin(old.row_hash)
+        # the hash test above can pass for a key and hash from different employees, so confirm on pairs
+        if same.any():
+            pairs = pd.MultiIndex.from_arrays([old.key, old.row_hash])
+            same = pd.MultiIndex.from_arrays([new.key, new.row_hash]).isin(pairs)
+
+        changes = pd.concat([new.loc[~same].assign(removed = False),
+                             old.loc[~old.key.isin(new.key)].assign(removed = True)], ignore_index = True)
+        changes = changes.drop(columns = "row_hash")
+
+        ints = [c for c in columns if pd.api.types.is_integer_dtype(changes[c])]
+        changes = changes.astype({c: "int64" for c in ints}).assign(export_date = export_date)
+
+        os.makedirs(self.path, exist_ok = True)
+        file = os.path.join(self.path, f"{export_date}.parquet")
+        changes.to_parquet(file + ".part", index = False)
+        os.replace(file + ".part", file)
+
+        self._versions = None
+
+        return changes.shape[0]
+
+    # READ
+
+    def versions(self):
+        """every stored row with the export date it appeared on and the date it was superseded (valid_to, missing if current)"""
+        if self._versions is None:
+            parts = [pd.read_parquet(os.path.join(self.path, f"{t}.parquet")) for t in self.dates()]
+            if not parts:
+                raise ValueError(f"no snapshots stored in {self.path}")
+
+            cats = {c for p in parts for c in p.columns if isinstance(p[c].dtype, pd.CategoricalDtype)}
+            # snapshots without changes are empty, and concatenating empty frames is deprecated. keep one for the columns
+            d = pd.concat([p for p in parts if p.shape[0] > 0] or parts[:1], ignore_index = True)
+            d = d.astype({c: "category" for c in cats if d[c].dtype == object})
+
+            d["valid_to"] = d.groupby("key", sort = False).export_date.shift(-1)
+            self._versions = d
+
+        return self._versions
+
+    def snapshot(self, export_date = None):
+        """employees as of export_date, by default the latest, with their key as the last column"""
+        v = self.versions()
+        if export_date is not None:
+            v = v.loc[v.export_date <= export_date]
+
+        v = v.loc[~v.key.duplicated(keep = "last") & ~v.removed]
+        v = v.drop(columns = ["export_date", "removed", "valid_to"])
+
+        ints = [c for c in v.columns if c != "key" and pd.api.types.is_integer_dtype(v[c])]
+        return v.assign(**{c: pd.to_numeric(v[c], downcast = "integer") for c in ints}).reset_index(drop = True)
+
+    def diff(self, start, end):
+        """employees whose rows differ between the snapshots of start and end, one row each with the
+        values at both (suffixed _start and _end) and change as one of hired, left or changed"""
+        v = self.versions()
+        keys = v.key[(v.export_date > start) & (v.export_date <= end)].unique()
+
+        a, b = self.snapshot(start), self.snapshot(end)
+        a, b = a.loc[a.key.isin(keys)], b.loc[b.key.isin(keys)]
+
+        # hashed before the merge, which turns integer columns with gaps into floats
+        columns = [c for c in b.columns if c != "key"]
+        a, b = a.assign(h = _row_hashes(a, columns)), b.assign(h = _row_hashes(b, columns))
+
+        d = a.merge(b, on = "key", how = "outer", suffixes = ("_start", "_end"), indicator = True)
+        d = d.loc[d._merge.ne("both") | d.h_start.ne(d.h_end)]
+
+        change = d._merge.map(dict(left_only = "left", right_only = "hired", both = "changed")).astype(str)
+        return d.drop(columns = ["_merge", "h_start", "h_end"]).assign(change = change).reset_index(drop = True)
+
+    def trajectory(self, by = "home_department", value = "annual_base_salary"):
+        """count, sum and mean of value per by group in every snapshot, long form.
+        computed from the changes alone: each stored row counts from its export date until it is superseded"""
+        v = self.versions()
+        v = v.loc[~v.removed]
+        dates = self.dates()
+
+        on = v.loc[:, [by, "export_date", value]].assign(n = 1)
+        off = v.loc[v.valid_to.notna(), [by, "valid_to", value]].rename(columns = {"valid_to": "export_date"})
+        off = off.assign(n = -1, **{value: -off[value]})
+
+        delta = pd.concat([on, off], ignore_index = True).groupby([by, "export_date"], observed = True)[[value, "n"]].sum()
+        full = pd.MultiIndex.from_product([delta.index.levels[0], dates], names = [by, "export_date"])
+
+        d = delta.reindex(full, fill_value = 0).groupby(level = 0, observed = True).cumsum()
+        d = d.rename(columns = {value: "sum", "n": "count"}).reset_index()
+        d = d.loc[d["count"] > 0].assign(mean = lambda x: x["sum"] / x["count"])
+
+        return d.loc[:, [by, "export_date", "count", "sum", "mean"]].reset_index(drop = True)
+
+
 ### OUT
 
-def clean_and_dump(file):
-    d = standardize(get_salaries(file))
+def clean_and_dump(file, formats = ('csv', 'xlsx')):
+    """write the standardized salaries in each of formats, see util.writers"""
+    d = load_salaries(file)
     
-    d.to_csv('../stor155_sp21/final_project/salaries/salaries.csv', index = False)
-    d.to_excel('../stor155_sp21/final_project/salaries/salaries.xlsx', index = False)
+    util.write_out(d, '../stor155_sp21/final_project/salaries/salaries', formats)
     
 
 ####
@@ -56,4 +319,18 @@ def clean_and_dump(file):
 ####
 
 if __name__ == "__main__":
-    clean_and_dump(raw_file)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser('Clean and write out UNC-CH salaries for STOR155 projects. run from the repository root')
+    parser.add_argument('--rebuild', action = 'store_true', help = 'ignore cached cleaning results')
+    parser.add_argument('--history', action = 'store_true', help = f'also add this export to the snapshot store in {history_dir}')
+
+    args = parser.parse_args()
+
+    if args.rebuild:
+        buildcache.invalidate('salaries.load_salaries')
+
+    clean_and_dump(raw_file)
+
+    if args.history:
+        print(f'{History().add(load_salaries(raw_file), export_date)} changed rows stored for {export_date}')
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""
+reproducible sampling of groups (states, countries, ...) for per-student project datasets
+
+a Sampler holds the groups of a dataset as slices of one sorted copy, and the groups eligible to be drawn.
+Sampler.assign(n, seed) draws a group for each of n students and returns an Assignment: a manifest of
+student, group and stratum plus the seed, and lazy views of the assigned rows. nothing is copied or
+written until a sink consumes it, e.g. Assignment.write, which goes through util.write_samples.
+
+    s = Sampler(data, by = 'state', eligible = ok)
+    a = s.assign(10000, seed = 155)
+    a.write('out', 'CV')                          # every student, plus out/CV_manifest.csv
+    s.load('out/CV_manifest.csv').write('out', 'CV', students = [17])   # just student 17 again
+
+with strata, students are spread evenly over the strata (in a shuffled order) and draw a group from
+within theirs, e.g. so that every region of the country is represented in a class.
+"""
+
+import numpy as np
+import pandas as pd
+import util
+
+
+manifest_columns = ['student', 'group', 'stratum', 'seed']
+
+
+def group_rows(data, by):
+    """{group: rows of data for that group}, in their original order. data is sorted by the by column once
+    and each group is a slice of that, so taking many samples costs no scans of data"""
+    order = data[by].to_numpy().argsort(kind = 'stable')
+    data = data.iloc[order]
+
+    groups, starts = pd.unique(data[by]), data[by].ne(data[by].shift()).to_numpy().nonzero()[0]
+    stops = list(starts[1:]) + [data.shape[0]]
+
+    return {v: data.iloc[a:b] for v, a, b in zip(groups, starts, stops)}
+
+
+def _lookup(f, groups, rows):
+    # f as one value per group: a callable on the group rows, a dict or Series keyed by group, or None
+    if f is None:
+        return pd.Series(True, index = groups)
+    if callable(f):
+        return pd.Series([f(rows[g]) for g in groups], index = groups)
+    return pd.Series(f).reindex(groups)
+
+
+class Sampler:
+    """groups of data to draw from.
+
+    data: a data frame split on its by column, or a mapping {group: data frame}
+    eligible: which groups may be drawn, as a predicate on a group's rows or a boolean Series/dict by group
+    strata: stratum of each group, as a function of a group's rows or a Series/dict by group"""
+
+    def __init__(self, data, by = None, eligible = None, strata = None):
+        # a mapping is kept as is, so its frames can be built lazily on first access
+        self.rows = group_rows(data, by) if by is not None else data
+
+        names = sorted(self.rows)
+        ok = _lookup(eligible, names, self.rows).fillna(False).astype(bool)
+
+        self.groups = pd.Index(names)[ok.to_numpy()]
+        self.strata = _lookup(strata, self.groups, self.rows) if strata is not None else None
+
+    def assign(self, n, seed = None, replace = True):
+        """draw a group for each of n students, see Assignment. seed None picks one, kept in the manifest"""
+        if self.groups.size == 0:
+            raise ValueError("no eligible groups to sample from")
+
+        seed = np.random.SeedSequence(seed).entropy
+        rng = np.random.default_rng(seed)
+
+        if self.strata is None:
+            strata = np.zeros(n, dtype = int)
+            members = {0: self.groups}
+        else:
+            levels = pd.unique(self.strata)
+            strata = np.resize(rng.permutation(len(levels)), n)
+            rng.shuffle(strata)
+            members = {i: self.groups[(self.strata == v).to_numpy()] for i, v in enumerate(levels)}
+
+        group = np.empty(n, dtype = object)
+        for i, g in members.items():
+            at = strata == i
+            m = int(at.sum())
+            if not replace and m > g.size:
+                raise ValueError(f"{m} students but {g.size} groups to draw from without replacement")
+            group[at] = g.to_numpy()[rng.choice(g.size, m, replace = replace)]
+
+        manifest = pd.DataFrame(dict(student = np.arange(n), group = group,
+                                     stratum = None if self.strata is None else levels[strata], seed = str(seed)))
+
+        return Assignment(self, manifest)
+
+    def load(self, file):
+        """the Assignment recorded in a manifest written by Assignment.write"""
+        manifest = pd.read_csv(file, dtype = dict(seed = str))
+        missing = set(manifest.group) - set(self.rows)
+        if missing:
+            raise ValueError(f"manifest groups not in the data: {sorted(missing)[:5]}")
+
+        return Assignment(self, manifest.loc[:, manifest_columns])
+
+
+class Assignment:
+    """groups drawn for students 0 ... n - 1. a sequence of data frames, student i's being a view of
+    the rows of its group, so it can be handed to anything taking a list of samples"""
+
+    def __init__(self, sampler, manifest):
+        self.sampler = sampler
+        self.manifest = manifest
+
+    def __len__(self):
+        return self.manifest.shape[0]
+
+    def __getitem__(self, i):
+        return self.sampler.rows[self.manifest.group.iat[i]]
+
+    def __iter__(self):
+        return (self.sampler.rows[g] for g in self.manifest.group)
+
+    def distinct(self):
+        """{group: rows} for the groups assigned at least once"""
+        return {g: self.sampler.rows[g] for g in pd.unique(self.manifest.group)}
+
+    def write(self, pathout, filepre, formats = ('csv', 'xlsx'), students = None, workers = None):
+        """write students' samples (default all) to pathout/filepre_{student}.{format}, see util.write_samples.
+        writing all also records the manifest at pathout/filepre_manifest.csv"""
+        m = self.manifest if students is None else self.manifest.set_index('student', drop = False).loc[students]
+
+        if students is None:
+            self.manifest.to_csv(f'{pathout}/{filepre}_manifest.csv', index = False)
+
+        samples = [self.sampler.rows[g] for g in m.group]
+
+        return util.write_samples(samples, pathout, filepre, formats = formats, workers = workers,
+                                  ids = list(m.student), keys = list(m.group))
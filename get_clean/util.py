@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""
+helpers shared by the get_clean modules
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+
+#######
+# WRITERS
+#######
+
+# one function per output format, taking a data frame and a file path.
+# module level so worker processes can look them up by name.
+# parquet and feather keep dtypes (Int64, datetimes, categories) intact and need pyarrow
+
+# excel can't handle more than 1,048,576 rows, header included
+# https://support.microsoft.com/en-us/office/excel-specifications-and-limits-1672b34d-7043-467e-8e27-269d656771c3
+excel_rows = 1048575
+
+# compression for the columnar formats
+compression = 'zstd'
+
+
+def _write_csv(d, file):
+    d.to_csv(file, index = False)
+
+
+def _write_xlsx(d, file):
+    # truncated to what excel can hold
+    d.iloc[:excel_rows].to_excel(file, index = False)
+
+
+def _write_parquet(d, file):
+    d.to_parquet(file, index = False, compression = compression)
+
+
+def _write_feather(d, file):
+    # feather needs a default index
+    d.reset_index(drop = True).to_feather(file, compression = compression)
+
+
+writers = dict(csv = _write_csv, xlsx = _write_xlsx, parquet = _write_parquet, feather = _write_feather)
+
+
+def _check_formats(formats):
+    unknown = [fmt for fmt in formats if fmt not in writers]
+    if unknown:
+        raise ValueError(f"unknown output formats {unknown}, choose from {list(writers)}")
+
+
+def _part(stem, fmt):
+    # files are written here first and then moved over stem.{fmt}, so an existing file is replaced rather than
+    # written through. that matters when it is a hard link to another sample's file, see write_samples
+    return f'{stem}.part.{fmt}'
+
+
+def write_out(d, stem, formats = ('csv', 'xlsx')):
+    """write d to stem.{format} for each format. returns {format: (bytes, seconds)}, None for a failed format"""
+    _check_formats(formats)
+    out = {}
+
+    for fmt in formats:
+        file = f'{stem}.{fmt}'
+        t = time.perf_counter()
+
+        try:
+            writers[fmt](d, _part(stem, fmt))
+            os.replace(_part(stem, fmt), file)
+            out[fmt] = (os.path.getsize(file), time.perf_counter() - t)
+        except Exception:
+            if os.path.exists(_part(stem, fmt)):
+                os.remove(_part(stem, fmt))
+            out[fmt] = None
+
+    return out
+
+
+# chunked versions of the writers for write_chunks: open(file) returns a writer with
+# write(chunk) and close(). every chunk must have the same columns and dtypes
+
+class _CsvChunks:
+    def __init__(self, file):
+        self.file, self.header = file, True
+
+    def write(self, d):
+        d.to_csv(self.file, index = False, header = self.header, mode = 'w' if self.header else 'a')
+        self.header = False
+
+    def close(self):
+        pass
+
+
+class _XlsxChunks:
+    # excel takes at most excel_rows, so only those are kept and written at the end
+    def __init__(self, file):
+        self.file, self.kept, self.rows = file, [], 0
+
+    def write(self, d):
+        if self.rows < excel_rows:
+            self.kept.append(d.iloc[:excel_rows - self.rows])
+            self.rows += self.kept[-1].shape[0]
+
+    def close(self):
+        _write_xlsx(pd.concat(self.kept, ignore_index = True), self.file)
+
+
+class _ArrowChunks:
+    # one parquet row group or ipc record batch per chunk
+    def __init__(self, file, fmt):
+        self.file, self.fmt, self.writer = file, fmt, None
+
+    def write(self, d):
+        import pyarrow as pa
+
+        t = pa.Table.from_pandas(d, preserve_index = False)
+
+        if self.writer is None:
+            if self.fmt == 'parquet':
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(self.file, t.schema, compression = compression)
+            else:
+                self.writer = pa.ipc.new_file(self.file, t.schema, options = pa.ipc.IpcWriteOptions(compression = compression))
+
+        self.writer.write_table(t)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+chunk_writers = dict(csv = _CsvChunks, xlsx = _XlsxChunks,
+                     parquet = lambda file: _ArrowChunks(file, 'parquet'), feather = lambda file: _ArrowChunks(file, 'feather'))
+
+
+def write_chunks(chunks, stem, formats = ('csv', 'xlsx')):
+    """write_out for data too large to hold at once: chunks is an iterable of data frames, written to
+    stem.{format} for all formats in a single pass. returns {format: (bytes, seconds)}"""
+    _check_formats(formats)
+
+    out = {fmt: chunk_writers[fmt](_part(stem, fmt)) for fmt in formats}
+    seconds = dict.fromkeys(formats, 0.0)
+
+    for d in chunks:
+        for fmt, w in out.items():
+            t = time.perf_counter()
+            w.write(d)
+            seconds[fmt] += time.perf_counter() - t
+
+    for fmt, w in out.items():
+        t = time.perf_counter()
+        w.close()
+        os.replace(_part(stem, fmt), f'{stem}.{fmt}')
+        seconds[fmt] += time.perf_counter() - t
+
+    return {fmt: (os.path.getsize(f'{stem}.{fmt}'), seconds[fmt]) for fmt in formats}
+
+
+def _sample_key(d):
+    # content hash, so equal samples drawn separately are still written once
+    return hashlib.sha1(pd.util.hash_pandas_object(d, index = True).values.tobytes() + str(list(d.columns)).encode()).hexdigest()
+
+
+def write_samples(samples, pathout, filepre, formats = ('csv', 'xlsx'), workers = None, ids = None, keys = None):
+    """write the data frames in samples to pathout/filepre_{i}.{format}, i being the position in samples
+    or ids[position] when given. formats are any of the keys in writers.
+
+    distinct samples are written on a pool of workers processes (None for one per core). repeats, common
+    since samples are drawn with replacement, are hard linked to the first copy, or copied where linking fails.
+    failed writes are skipped. keys, one per sample, say which samples are equal when the caller already
+    knows (e.g. sampled group names), otherwise samples are compared by content.
+    prints and returns a summary per format: files, bytes and seconds written, and the files and bytes linked
+    (or copied) from those."""
+
+    _check_formats(formats)
+    ids = range(len(samples)) if ids is None else ids
+    name = pathout + '/' + filepre + '_{}'
+    stem = lambda i: name.format(ids[i])
+
+    # position of the first occurrence of each distinct sample
+    keys = [_sample_key(d) for d in samples] if keys is None else list(keys)
+    first = {}
+    for i, k in enumerate(keys):
+        first.setdefault(k, i)
+
+    summary = {fmt: dict(files = 0, bytes = 0, seconds = 0.0, linked = 0, linked_bytes = 0, failed = 0) for fmt in formats}
+    t = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        written = {k: pool.submit(write_out, samples[i], stem(i), formats) for k, i in first.items()}
+        written = {k: f.result() for k, f in written.items()}
+
+    for i, k in enumerate(keys):
+        for fmt in formats:
+            s = summary[fmt]
+            res = written[k][fmt]
+
+            if res is None:
+                s['failed'] += 1
+                continue
+
+            if i != first[k]:
+                src, dst = f'{stem(first[k])}.{fmt}', f'{stem(i)}.{fmt}'
+
+                if os.path.exists(dst):
+                    os.remove(dst)
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copyfile(src, dst)
+
+                s['linked'] += 1
+                s['linked_bytes'] += res[0]
+            else:
+                s['files'] += 1
+                s['bytes'] += res[0]
+                s['seconds'] += res[1]
+
+    print(f'wrote {len(samples)} samples ({len(first)} distinct) in {time.perf_counter() - t:.1f}s')
+    for fmt, s in summary.items():
+        print(f"  {fmt}: {s['files']} files written, {s['bytes'] / 2**20:.1f} MB in {s['seconds']:.1f}s; "
+              f"{s['linked']} linked, {s['linked_bytes'] / 2**20:.1f} MB; {s['failed']} failed")
+
+    return summary
@@ -0,0 +1,62 @@
+"""
+buildcache.file_hash and the hashes it stores, from threads and alongside other processes. run from the repository root
+
+python -m pytest tests
+"""
+
+import os
+import sys
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'get_clean'))
+
+import buildcache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(buildcache, 'cache_dir', str(tmp_path / 'cache'))
+    monkeypatch.setattr(buildcache, '_hashes', {})
+
+    files = []
+    for i in range(64):
+        files.append(str(tmp_path / f'{i}.txt'))
+        with open(files[-1], 'w') as f:
+            f.write(f'file {i}\n' * (i + 1))
+
+    return files
+
+
+def _stored():
+    with open(os.path.join(buildcache.cache_dir, buildcache._hashes_file)) as f:
+        return json.load(f)
+
+
+def test_threads(cache):
+    with ThreadPoolExecutor(max_workers = 16) as pool:
+        got = list(pool.map(buildcache.file_hash, cache))
+
+    assert got == [hashlib.sha1(open(f, 'rb').read()).hexdigest() for f in cache]
+    assert sorted(_stored()) == sorted(buildcache._stat_key(f) for f in cache)
+    assert [f for f in os.listdir(buildcache.cache_dir) if f.endswith('.part')] == []
+
+
+def test_merge(cache, monkeypatch):
+    # hashes another process stored after this one loaded the file are kept
+    buildcache.file_hash(cache[0])
+
+    with open(os.path.join(buildcache.cache_dir, buildcache._hashes_file), 'w') as f:
+        json.dump({'elsewhere:1:1': 'abc'}, f)
+
+    buildcache.file_hash(cache[1])
+
+    assert sorted(_stored()) == sorted(['elsewhere:1:1'] + [buildcache._stat_key(f) for f in cache[:2]])
+
+    # and are used by a new process
+    monkeypatch.setattr(buildcache, '_hashes', {})
+    assert buildcache.file_hash(cache[1]) == hashlib.sha1(open(cache[1], 'rb').read()).hexdigest()
+    assert 'elsewhere:1:1' in buildcache._hashes
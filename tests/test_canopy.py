@@ -0,0 +1,115 @@
+"""
+canopy.tif_to_df on small synthetic GeoTIFFs, tiled and stripped, against np.unique of the whole raster.
+run from the repository root
+
+python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip('rasterio')
+import rasterio.features
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'get_clean'))
+
+import canopy
+
+
+height, width = 300, 250
+transform = from_origin(1000, 2000, 30, 30)
+
+# a county-ish polygon over part of the raster, in the raster crs. its corners are off the cell grid, so that no
+# edge runs exactly through cell centers, where inside or outside would be a tie
+def _point(col, row):
+    return 1000 + 30 * col, 2000 - 30 * row
+
+shape = dict(type = 'Polygon', coordinates = [[_point(20.3, 15.7), _point(200.6, 40.2), _point(170.1, 260.9),
+                                               _point(35.4, 210.35), _point(20.3, 15.7)]])
+
+
+def _values(seed = 0):
+    # percent cover 0 to 100, with a border of 255 as nodata, like the clipped county rasters
+    a = np.random.default_rng(seed).integers(0, 101, (height, width)).astype('uint8')
+    a[:7], a[:, -11:] = 255, 255
+    return a
+
+
+def _write(path, a, tiled, nodata):
+    layout = dict(tiled = True, blockxsize = 64, blockysize = 32) if tiled else dict(tiled = False, blockysize = 3)
+    with rasterio.open(path, 'w', driver = 'GTiff', height = height, width = width, count = 1, dtype = 'uint8',
+                       crs = 'EPSG:5070', transform = transform, nodata = nodata, **layout) as r:
+        r.write(a, 1)
+    return str(path)
+
+
+def _expected(a, keep):
+    value, count = np.unique(a[keep], return_counts = True)
+    return value.astype('int64'), count.astype('int64')
+
+
+@pytest.fixture(params = ['tiled', 'stripped'])
+def raster(request, tmp_path):
+    a = _values()
+    return a, request.param, lambda nodata: _write(tmp_path / f'{request.param}.tif', a, request.param == 'tiled', nodata)
+
+
+@pytest.mark.parametrize('tile', [1, 40, 100, 1024])
+@pytest.mark.parametrize('nodata', [None, 255])
+def test_counts(raster, tile, nodata):
+    a, layout, write = raster
+    file = write(nodata)
+
+    with rasterio.open(file) as r:
+        assert r.block_shapes[0] == ((32, 64) if layout == 'tiled' else (3, width))
+
+    d = canopy.tif_to_df(file, tile = tile)
+    value, count = _expected(a, np.ones(a.shape, dtype = bool) if nodata is None else a != nodata)
+
+    assert list(d.columns) == ['Value', 'Count']
+    np.testing.assert_array_equal(d.Value.to_numpy(), value)
+    np.testing.assert_array_equal(d.Count.to_numpy(), count)
+
+
+@pytest.mark.parametrize('tile', [1, 40, 1024])
+def test_nodata_argument(raster, tile):
+    # nodata given overrides the file's, here a file without one
+    a, _, write = raster
+    d = canopy.tif_to_df(write(None), nodata = 0, tile = tile)
+
+    value, count = _expected(a, a != 0)
+    np.testing.assert_array_equal(d.Value.to_numpy(), value)
+    np.testing.assert_array_equal(d.Count.to_numpy(), count)
+
+
+@pytest.mark.parametrize('tile', [1, 40, 100, 1024])
+@pytest.mark.parametrize('nodata', [None, 255])
+def test_shape(raster, tile, nodata):
+    # only cells whose centers fall inside the shape count
+    a, _, write = raster
+    d = canopy.tif_to_df(write(nodata), shape = shape, tile = tile)
+
+    inside = rasterio.features.geometry_mask([shape], out_shape = a.shape, transform = transform, invert = True)
+    value, count = _expected(a, inside if nodata is None else inside & (a != nodata))
+
+    assert 0 < count.sum() < a.size
+    np.testing.assert_array_equal(d.Value.to_numpy(), value)
+    np.testing.assert_array_equal(d.Count.to_numpy(), count)
+
+
+def test_read_counties(tmp_path):
+    # every county has one source, its dbf where there is one, so raster-only counties aren't left out
+    config = tmp_path / 'counties.csv'
+    config.write_text('county,area,dbf,tif\n'
+                      'durham,722,raw/durham_canopy.dbf,raw/durham_canopy.tif\n'
+                      'wake,,,raw/nc_canopy.tif\n'
+                      'orange,1039,raw/orange_canopy.dbf,\n')
+    sources, files_tif, county_area = canopy.read_counties(str(config))
+
+    assert sources == dict(durham = 'raw/durham_canopy.dbf', wake = 'raw/nc_canopy.tif', orange = 'raw/orange_canopy.dbf')
+    assert files_tif == dict(durham = 'raw/durham_canopy.tif', wake = 'raw/nc_canopy.tif')
+    assert county_area == dict(durham = 722, orange = 1039)
@@ -0,0 +1,84 @@
+"""
+canopy.Histogram against the row-per-cell data from canopy.unpack, on synthetic county counts: a chi-square
+goodness of fit check that both sample from the same per-value distribution (each value drawn in proportion
+to its cell count), with fixed seeds. draws without replacement run low on the statistic, by about the finite
+population correction 1 - n / cells, so the same threshold is conservative for them. run from the repository root
+
+python -m pytest tests
+"""
+
+import os
+import sys
+import math
+
+import numpy as np
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'get_clean'))
+sys.path.insert(0, os.path.join(here, '..', 'bench'))
+
+import canopy
+import synthetic
+
+
+n = 200000
+
+# smallest p-value accepted. the seeds are fixed, so this only catches a broken sampler, never flakes
+alpha = 0.001
+
+
+def chisq(observed, expected):
+    """statistic and p-value, the latter via the Wilson-Hilferty normal approximation (no scipy needed)"""
+    keep = expected > 0
+    stat = float(((observed[keep] - expected[keep]) ** 2 / expected[keep]).sum())
+    df = int(keep.sum()) - 1
+    z = ((stat / df) ** (1 / 3) - (1 - 2 / (9 * df))) / math.sqrt(2 / (9 * df))
+
+    return stat, df, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def counts(values, support):
+    return np.array([np.count_nonzero(values == v) for v in support], dtype = float)
+
+
+@pytest.fixture(scope = 'module')
+def county():
+    d, area = synthetic.canopy_counts(1, seed = 0)
+    return canopy.histogram(data = d.copy(), county_area = area), canopy.unpack(data = d.copy(), county_area = area)
+
+
+@pytest.mark.parametrize('draw', ['histogram', 'histogram, no replacement', 'unpacked'])
+def test_same_distribution(county, draw):
+    h, u = county
+    support = h.data.value.to_numpy()
+    expected = h.data.loc[:, 'count'].to_numpy() / h.cells * n
+
+    values = {'histogram': lambda: h.sample(n, seed = 1).value.to_numpy(),
+              'histogram, no replacement': lambda: h.sample(n, replace = False, seed = 2).value.to_numpy(),
+              'unpacked': lambda: u.value.sample(n, replace = True, random_state = 3).to_numpy()}[draw]()
+
+    stat, df, p = chisq(counts(values, support), expected)
+    assert p > alpha, f'{draw}: chisq = {stat:.1f} on {df} df, p = {p:.2g}'
+
+
+@pytest.mark.parametrize('share', [0.01, 0.5, 0.99, 1])
+def test_no_replacement_within_counts(county, share):
+    # no value is drawn more often than it has cells, and drawing every cell gives the counts back
+    h, _ = county
+    k = int(h.cells * share)
+    drawn = h.sample(k, replace = False, seed = 4).value.value_counts()
+
+    available = h.data.set_index('value').loc[:, 'count']
+    assert drawn.shape[0] <= available.shape[0]
+    assert (drawn <= available.reindex(drawn.index)).all()
+    assert drawn.sum() == k
+
+    if share == 1:
+        assert drawn.reindex(available.index).eq(available).all()
+
+
+def test_no_replacement_too_many(county):
+    h, _ = county
+    with pytest.raises(AssertionError):
+        h.sample(h.cells + 1, replace = False)
@@ -0,0 +1,34 @@
+"""
+catalog lookups come back with the dtypes that were ingested. run from the repository root
+
+python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'get_clean'))
+
+import catalog
+
+
+def test_roundtrip(tmp_path):
+    # last_record_on is an object column of Timestamps, as covid_by_co leaves it, and comes back as datetime64
+    d = pd.DataFrame(dict(state = ['NC', 'NC', 'VA'], fips = pd.array([37063, None, 51001], dtype = 'Int64'),
+                          cases = [1.5, np.nan, 3.0],
+                          last_record_on = pd.Series([pd.Timestamp('2021-05-01'), pd.Timestamp('2021-05-02 10:30'), None],
+                                                     dtype = object)))
+    assert d.last_record_on.dtype == object
+
+    cat = catalog.Catalog(str(tmp_path / 'stor.sqlite'))
+    try:
+        cat.ingest_covid(d)
+        got = cat.covid()
+    finally:
+        cat.close()
+
+    expected = d.assign(last_record_on = pd.to_datetime(d.last_record_on))
+    pd.testing.assert_frame_equal(got, expected)
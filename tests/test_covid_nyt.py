@@ -0,0 +1,210 @@
+"""
+covid_nyt.get_raw against a local file server with fixture csvs, no network needed. run from the repository root
+
+python -m pytest tests
+"""
+
+import os
+import re
+import sys
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pandas as pd
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'get_clean'))
+sys.path.insert(0, os.path.join(here, '..', 'bench'))
+
+import covid_nyt
+import synthetic
+
+
+# a hundred counties over 20 days, in date order as NYT publishes them
+counties = synthetic.nyt_counties(0.05, 0)
+counties = counties.loc[counties.county.isin(counties.county.unique()[:100])]
+dates = sorted(counties.date.unique())
+
+
+def _csv(d):
+    return d.to_csv(index = False).encode()
+
+
+def _upto(i):
+    return counties.loc[counties.date <= dates[i]]
+
+
+class Server(BaseHTTPRequestHandler):
+    """files by name, with ETag validators and, when ranges is set, byte ranges"""
+    protocol_version = 'HTTP/1.1'
+
+    files = {}
+    ranges = True
+    log = []
+
+    def _send(self, status, body = b'', headers = {}):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        name = self.path.rsplit('/', 1)[-1]
+        rng = self.headers.get('Range')
+        self.log.append((name, self.headers.get('If-None-Match'), rng))
+
+        if name not in self.files:
+            return self._send(404)
+
+        body = self.files[name]
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, headers = {'ETag': etag})
+
+        if rng and self.ranges:
+            start = int(re.match(r'bytes=(\d+)-', rng).group(1))
+            if start >= len(body):
+                return self._send(416, headers = {'Content-Range': f'bytes */{len(body)}'})
+            return self._send(206, body[start:], {'ETag': etag, 'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'})
+
+        self._send(200, body, {'ETag': etag})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # the module's raw/ paths resolve inside tmp_path
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('raw')
+
+    monkeypatch.setattr(Server, 'files', {'us-counties.csv': _csv(_upto(5)),
+                                          'mask-use-by-county.csv': _csv(synthetic.nyt_masks(0))})
+    monkeypatch.setattr(Server, 'ranges', True)
+    monkeypatch.setattr(Server, 'log', [])
+    monkeypatch.setattr(covid_nyt, 'sources', dict(maskuse = 'mask-use/mask-use-by-county', covid = 'us-counties'))
+
+    s = ThreadingHTTPServer(('127.0.0.1', 0), Server)
+    threading.Thread(target = s.serve_forever, daemon = True).start()
+
+    yield Server, f'http://127.0.0.1:{s.server_port}/'
+
+    s.shutdown()
+    s.server_close()
+
+
+def _check(served):
+    # the local csv is the served one, and the pickled aggregate is that of the csv
+    assert open(covid_nyt.by_co_source, 'rb').read() == served.files['us-counties.csv']
+
+    expected = covid_nyt.covid_by_co_stream(covid_nyt.by_co_source).sort_values(['county', 'state']).reset_index(drop = True)
+    got = pd.read_pickle(covid_nyt.by_co_file).sort_values(['county', 'state']).reset_index(drop = True)
+    pd.testing.assert_frame_equal(got, expected)
+
+
+def _counties_log(served):
+    return [(inm is not None, rng is not None) for name, inm, rng in served.log if name == 'us-counties.csv']
+
+
+def test_first_download(server):
+    served, base = server
+    covid_nyt.get_raw(base)
+
+    _check(served)
+    assert os.path.exists('raw/maskuse_nyt.csv')
+    assert _counties_log(served) == [(False, False)]
+
+
+def test_unchanged(server):
+    # validators make the second request conditional, and a 304 leaves everything alone
+    served, base = server
+    covid_nyt.get_raw(base)
+    mtime = os.path.getmtime(covid_nyt.by_co_file)
+
+    served.log.clear()
+    covid_nyt.get_raw(base)
+
+    assert _counties_log(served) == [(True, True)]
+    assert os.path.getmtime(covid_nyt.by_co_file) == mtime
+    _check(served)
+
+
+def test_append(server):
+    # only the bytes from the last local line on are sent, and the new rows folded into the aggregate
+    served, base = server
+    covid_nyt.get_raw(base)
+
+    served.files['us-counties.csv'] = _csv(_upto(9))
+    served.log.clear()
+    covid_nyt.get_raw(base)
+
+    assert _counties_log(served) == [(True, True)]
+    _check(served)
+
+
+def test_append_without_ranges(server, monkeypatch):
+    # a server ignoring Range sends the whole file, of which the rows after the last local one are kept
+    served, base = server
+    covid_nyt.get_raw(base)
+
+    monkeypatch.setattr(served, 'ranges', False)
+    served.files['us-counties.csv'] = _csv(_upto(9))
+    covid_nyt.get_raw(base)
+
+    _check(served)
+
+
+def test_rewritten(server):
+    # a range that doesn't start with the last local line means NYT rewrote the file, so it is fetched whole
+    served, base = server
+    covid_nyt.get_raw(base)
+
+    served.files['us-counties.csv'] = _csv(_upto(9).assign(cases = lambda x: x.cases + 1))
+    served.log.clear()
+    covid_nyt.get_raw(base)
+
+    assert _counties_log(served) == [(True, True), (False, False)]
+    _check(served)
+
+
+def test_shorter(server):
+    # a 416, the served file being shorter than the local one, is also fetched whole
+    served, base = server
+    covid_nyt.get_raw(base)
+
+    served.files['us-counties.csv'] = _csv(_upto(1))
+    served.log.clear()
+    covid_nyt.get_raw(base)
+
+    assert _counties_log(served) == [(True, True), (False, False)]
+    _check(served)
+
+
+def test_not_incremental(server):
+    served, base = server
+    covid_nyt.get_raw(base)
+
+    served.files['us-counties.csv'] = _csv(_upto(9))
+    served.log.clear()
+    covid_nyt.get_raw(base, incremental = False)
+
+    assert _counties_log(served) == [(False, False)]
+    _check(served)
+
+
+def test_project_data_other_file(server):
+    # the aggregate is only used for the file it was made from
+    served, base = server
+    covid_nyt.get_raw(base)
+
+    _upto(2).to_csv('other.csv', index = False)
+    masks = synthetic.nyt_masks(0)
+
+    assert covid_nyt.project_data(county = 'other.csv', masks = masks).cases.sum() == covid_nyt.covid_by_co(data = _upto(2)).cases.sum()
+    assert covid_nyt.project_data(county = covid_nyt.by_co_source, masks = masks).cases.sum() == pd.read_pickle(covid_nyt.by_co_file).cases.sum()
@@ -0,0 +1,200 @@
+"""
+fredapi against a local stub of the FRED api, no network or key needed. run from the repository root
+
+python -m pytest tests
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'get_clean'))
+
+import fredapi
+
+
+countries = ['France', 'Spain', 'Italy', 'Norway']
+
+
+def _series():
+    # tags/series records for gdp and employment by gender, titled as FRED titles them
+    gdp = [dict(id = f'GDP{c[:3].upper()}', title = f'Gross Domestic Product for {c}') for c in countries]
+    empl = [dict(id = f'EMP{g[0]}{c[:3].upper()}', title = f'Employment to Population Rate: All Ages: {g} for {c}')
+            for c in countries for g in ['Females', 'Males']]
+
+    common = dict(frequency_short = 'Q', seasonal_adjustment_short = 'NSA', last_updated = '2021-05-01 08:00:00-05')
+    return {fredapi.indicators['gdp']['tags']: [dict(s, **common) for s in gdp],
+            fredapi.indicators['empl']['tags']: [dict(s, **common) for s in empl]}
+
+
+class Stub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # seconds each observations request takes, and observations in each series
+    delay = 0.0
+    periods = 8
+    series = _series()
+    log = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.log.append((url.path, q))
+
+        if url.path.endswith('tags/series'):
+            found = sorted(self.series.get(q['tag_names'], []), key = lambda s: s['id'])
+            offset, limit = int(q['offset']), int(q['limit'])
+            body = dict(count = len(found), offset = offset, limit = limit, seriess = found[offset:offset + limit])
+        elif url.path.endswith('series/observations'):
+            time.sleep(self.delay)
+            dates = pd.date_range('2000-01-01', periods = self.periods, freq = 'QS').strftime('%Y-%m-%d')
+            body = dict(observations = [dict(date = d, value = '.' if i == 3 else str(i)) for i, d in enumerate(dates)
+                                        if d >= q.get('observation_start', '')])
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        b = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+
+    monkeypatch.setattr(fredapi, 'base_url', f'http://127.0.0.1:{server.server_port}/')
+    monkeypatch.setattr(fredapi, 'index_file', str(tmp_path / 'fred_index.csv'))
+    monkeypatch.setattr(fredapi, 'cache', None)
+    # each test starts with an empty rate limit window, so requests from earlier tests don't slow it down
+    monkeypatch.setattr(fredapi, '_sent', deque())
+    monkeypatch.setattr(Stub, 'log', [])
+
+    yield Stub
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_discover_series_sets(stub):
+    # each string is one whole set of tags, and every page of every set is requested
+    tags = [v['tags'] for v in fredapi.indicators.values()]
+    d = fredapi.discover_series('key', tags, limit = 3)
+
+    assert set(d.id) == {s['id'] for ss in stub.series.values() for s in ss}
+    assert {q['tag_names'] for _, q in stub.log} == set(tags)
+    # 4 gdp series are 2 pages, 8 employment series 3
+    assert len(stub.log) == 2 + 3
+
+    # a single string or list of tags is a single set
+    gdp = fredapi.indicators['gdp']['tags']
+    assert fredapi.discover_series('key', gdp).shape[0] == len(countries)
+    assert fredapi.discover_series('key', [gdp.split(';')]).shape[0] == len(countries)
+
+
+def test_get_and_dump(stub, tmp_path):
+    fredapi.get_and_dump('key', 6, str(tmp_path), formats = ('csv',), seed = 0, write_workers = 1)
+
+    index = fredapi.SeriesIndex(fredapi.index_file)
+    assert sorted(set(index.data.country)) == sorted(c.lower() for c in countries)
+
+    ids = index.panel(dict(gdp = ('gdp', ''), Females = ('empl', 'females'), Males = ('empl', 'males')))
+    manifest = pd.read_csv(tmp_path / 'FRED_manifest.csv')
+    assert manifest.shape[0] == 6
+
+    # columns keep the series ids, so students can look them up on FRED
+    for i, country in zip(manifest.student, manifest.group):
+        d = pd.read_csv(tmp_path / f'FRED_{i}.csv')
+        assert list(d.columns) == ['date'] + list(ids.loc[country])
+        assert d.shape[0] == 8 and d.iloc[:, 1:].isna().sum().eq(1).all()
+
+
+def test_update_empty(stub):
+    # nothing discovered leaves the index as it was
+    index = fredapi.SeriesIndex(fredapi.index_file)
+    assert index.update(fredapi.discover_series('key', ['no;such;tags'])) == 0
+    assert index.data.empty
+
+
+def test_update_rejected(stub, monkeypatch):
+    # series that are rejected, by title or as duplicates, are recorded and not parsed again until they change
+    series = _series()
+    common = dict(frequency_short = 'Q', seasonal_adjustment_short = 'NSA', last_updated = '2021-05-01 08:00:00-05')
+    series[fredapi.indicators['gdp']['tags']] += [
+        dict(common, id = 'GDPX', title = 'Gross Domestic Product for Euro Area (DISCONTINUED)'),
+        dict(common, id = 'GDPY', title = 'Real Gross Domestic Product, Chained Dollars'),
+        dict(common, id = 'GDPFRA2', title = 'Gross Domestic Product for France', last_updated = '2020-01-01 08:00:00-05')]
+    monkeypatch.setattr(stub, 'series', series)
+
+    tags = [v['tags'] for v in fredapi.indicators.values()]
+    index = fredapi.SeriesIndex(fredapi.index_file)
+    assert index.update(fredapi.discover_series('key', tags)) == 3 * len(countries) + 3
+    index.save()
+
+    index = fredapi.SeriesIndex(fredapi.index_file)
+    assert index.update(fredapi.discover_series('key', tags)) == 0
+
+    assert set(index.data.id[index.data.country == '']) == {'GDPX', 'GDPY'}
+    assert index.get('gdp', 'france') == 'GDPFRA'
+    assert list(index.panel(dict(gdp = ('gdp', ''))).index) == sorted(c.lower() for c in countries)
+
+    # a rejected series that FRED updates is parsed again
+    series[fredapi.indicators['gdp']['tags']][-3] = dict(common, id = 'GDPX', title = 'Gross Domestic Product for Euro Area',
+                                                         last_updated = '2021-06-01 08:00:00-05')
+    assert index.update(fredapi.discover_series('key', tags)) == 1
+    assert index.get('gdp', 'euro area') == 'GDPX'
+
+
+def test_concurrency(stub, monkeypatch):
+    # wall time is set by the number of workers, not the number of series, while under the rate limit
+    monkeypatch.setattr(stub, 'delay', 0.2)
+    ids = [f'S{i}' for i in range(16)]
+
+    t = time.perf_counter()
+    panels = fredapi.Panels(pd.DataFrame(dict(a = ids[:8], b = ids[8:])), lambda v: fredapi.get_series('key', ids = v), workers = 16)
+    panels.prefetch(panels.ids.index)
+
+    assert time.perf_counter() - t < 16 * 0.2 / 4
+
+
+@pytest.mark.parametrize('revisions', [0, 1, 3, 100])
+def test_update_series(stub, tmp_path, monkeypatch, revisions):
+    store = str(tmp_path / 'fred')
+    full = fredapi.update_series('key', ids = 'GDPFRA', store = store, revisions = revisions)
+    assert full.shape[0] == 8
+
+    # two new quarters published
+    monkeypatch.setattr(stub, 'periods', 10)
+    stub.log.clear()
+    d = fredapi.update_series('key', ids = 'GDPFRA', store = store, revisions = revisions)
+
+    start = stub.log[-1][1].get('observation_start')
+    if revisions == 0:
+        assert start == '2001-10-02'
+    else:
+        assert start == full.date.iloc[max(8 - revisions, 0)].strftime('%Y-%m-%d')
+
+    assert d.shape[0] == 10 and d.date.is_unique
+    assert d.equals(pd.read_csv(f'{store}/GDPFRA.csv', parse_dates = ['date']))
+
+
+def test_update_series_negative(stub, tmp_path):
+    with pytest.raises(ValueError):
+        fredapi.update_series('key', ids = 'GDPFRA', store = str(tmp_path), revisions = -1)
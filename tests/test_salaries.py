@@ -0,0 +1,104 @@
+"""
+salaries on small synthetic workbooks and frames. run from the repository root
+
+python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'get_clean'))
+sys.path.insert(0, os.path.join(here, '..', 'bench'))
+
+import salaries
+import synthetic
+from salaries_standardize import before
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    pytest.importorskip('openpyxl')
+    pytest.importorskip('pyarrow')
+
+    file = str(tmp_path / 'salaries.xlsx')
+    synthetic.salaries_raw(0.005, seed = 0).to_excel(file, index = False)
+    return file
+
+
+def test_cache_per_engine(workbook, monkeypatch):
+    # each engine has its own cache, so a cache written by one is never read back for another
+    calls = []
+    for k, read in list(salaries.readers.items()):
+        monkeypatch.setitem(salaries.readers, k, lambda file, k = k, read = read: calls.append(k) or read(file))
+
+    first = salaries.get_salaries(workbook)
+    assert salaries.get_salaries(workbook).equals(first)
+    assert calls == ['stream']
+
+    d = salaries.get_salaries(workbook, engine = 'openpyxl')
+    salaries.get_salaries(workbook, engine = 'openpyxl')
+    assert calls == ['stream', 'openpyxl']
+
+    assert os.path.exists(salaries.cache_file(workbook)) and os.path.exists(salaries.cache_file(workbook, 'openpyxl'))
+    # the engines don't agree on types either: read_excel makes numbers of digit-only text like INIT
+    assert d.shape == first.shape
+
+
+def _raw(n = 40, seed = 0):
+    # categories that differ only in case, which lowercasing merges, and missing values in low and high
+    # cardinality text columns
+    rng = np.random.default_rng(seed)
+    dept = np.array(['Dept A', 'DEPT A', 'dept a', 'Dept B', np.nan], dtype = object)[rng.integers(0, 5, n)]
+    title = np.array([f'Title {i} MiXed' for i in range(n)], dtype = object)
+    title[::7] = np.nan
+
+    return pd.DataFrame({'LAST NAME': [f'Last{i}' for i in range(n)],
+                         'FIRST NAME': rng.choice(['Ann', 'ANN', 'Bo'], n).astype(object),
+                         'INIT': rng.choice(['A', 'b', ''], n).astype(object),
+                         'AGE': rng.integers(18, 90, n),
+                         'INITIAL HIRE DATE': pd.date_range('1990-01-01', periods = n, freq = '97D').strftime('%b %d, %Y').str.upper(),
+                         'JOB CATEGORY': rng.choice(['Faculty', 'FACULTY', 'Staff'], n).astype(object),
+                         'EMPLOYEE ANNUAL BASE SALARY': rng.lognormal(11, 0.5, n).round(2),
+                         'EMPLOYEE HOME DEPARTMENT': dept,
+                         'PRIMARY WORKING TITLE': title})
+
+
+# the old path parses hire dates without a format
+@pytest.mark.filterwarnings('ignore:Could not infer format')
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_standardize_as_before(seed):
+    # the same values as the old per-column str.lower path, once the new dtypes are cast back
+    raw = _raw(seed = seed)
+    old, new = before(raw.copy()), salaries.standardize(raw.copy())
+
+    assert isinstance(new.home_department.dtype, pd.CategoricalDtype) and isinstance(new.job_category.dtype, pd.CategoricalDtype)
+    assert new.primary_working_title.dtype == object
+    assert set(new.home_department.cat.categories) == {'dept a', 'dept b'}
+    assert new.home_department.isna().sum() == raw['EMPLOYEE HOME DEPARTMENT'].isna().sum() > 0
+
+    pd.testing.assert_frame_equal(new.astype(old.dtypes.to_dict()), old)
+
+
+@pytest.mark.filterwarnings('error::FutureWarning')
+def test_history_unchanged_snapshot(tmp_path):
+    # a snapshot with no changes stores no rows, and is still part of the history
+    pytest.importorskip('pyarrow')
+
+    d = salaries.standardize(_raw())
+    h = salaries.History(str(tmp_path / 'history'))
+
+    assert h.add(d, '2021-01-29') == d.shape[0]
+    assert h.add(d, '2021-04-29') == 0
+    raised = d.assign(annual_base_salary = d.annual_base_salary.where(d.index > 0, d.annual_base_salary + 1000))
+    assert h.add(raised, '2021-07-29') == 1
+
+    assert h.dates() == ['2021-01-29', '2021-04-29', '2021-07-29']
+    assert h.versions().shape[0] == d.shape[0] + 1
+    assert h.snapshot('2021-04-29').annual_base_salary.sum() == pytest.approx(d.annual_base_salary.sum())
+    assert h.diff('2021-01-29', '2021-04-29').empty
+    assert h.diff('2021-04-29', '2021-07-29').change.tolist() == ['changed']